@@ -5,6 +5,7 @@ import matplotlib.patches as patches
 import pandas as pd
 from pathlib import Path
 import utils.signal_file_handler as sfh
+import utils.spectrogram as spg
 # %%
 folder = Path('/home/xiao/Downloads/915_mavic2')
 if not folder.is_dir():
@@ -22,14 +23,11 @@ nfft = 512
 down_sample = 20
 
 capture = sfh.CaptureFile(path=str(next(path_gen)))
-data = capture.payload
-data_reshape = np.reshape(
-    data[:len(data) - len(data) % (nfft * down_sample)], (-1, nfft * down_sample))
-data_reshape = data_reshape[:, :nfft]  # down sampling
-data_fft = np.fft.fft(data_reshape, axis=1)
-data_fft = np.fft.fftshift(data_fft, axes=1)
-data_fft = np.flip(data_fft, axis=1)  # put lower freq in the lower part 
-data_fft = np.abs(data_fft.T)
+data = capture.samples(dtype=np.complex64)
+data_fft = spg.spectrogram(
+    data[:len(data) - len(data) % (nfft * down_sample)], nfft=nfft,
+    hop=nfft * down_sample, mode='magnitude', log=False)  # down sampling
+data_fft = np.flip(data_fft, axis=0)  # put lower freq in the lower part 
 data_fft[data_fft < 1] = 1  # avoid log(0)
 data_fft = np.log10(data_fft)
 
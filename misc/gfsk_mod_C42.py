@@ -1,17 +1,23 @@
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy.stats import norm
+from functools import lru_cache
+import argparse
+import sys
+import time
+from pathlib import Path
+# the utils modules import each other as top level modules
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'utils'))
+import cumulants  # noqa: E402
 
 
 def get_c42(x):
-    def moment(x, p, q):
-        return np.mean(x ** (p - q) * np.conj(x) ** q)
-    x -= np.mean(x)
-    c21 = moment(x, 2, 1).real
-    c42 = moment(x, 4, 2) - np.abs(moment(x, 2, 0)
-                                   ) ** 2 - 2 * moment(x, 2, 1) ** 2
-    c42 = c42.real / c21 ** 2
-    return c42
+    """
+    normalized C42 of a signal, see cumulants.CumulantAccumulator
+
+    x is not modified, int16 I/Q and capture files are accepted
+    """
+    return cumulants.c42(x)
 
 
 def upsample(x, n):
@@ -26,31 +32,63 @@ def upsample(x, n):
     return zo.flatten()
 
 
-def gfsk_mod(msg, sps, bt, mi):
+@lru_cache(maxsize=None)
+def gaussian_pulse(sps, bt):
+    """
+    frequency pulse of one symbol, Gaussian filter with a span of one
+    symbol, normalized to a unit sum. Cached per (sps, bt), read-only
+    """
+    t = np.arange((-0.5 + 1 / sps / 2), 0.5, 1 / sps)
+    shape = norm.cdf(2 * np.pi * bt * (t + 0.5) / np.sqrt(np.log(2))) - \
+        norm.cdf(2 * np.pi * bt * (t - 0.5) / np.sqrt(np.log(2)))
+    shape = shape / shape.sum()
+    shape.flags.writeable = False
+    return shape
+
+
+def gfsk_mod(msg, sps, bt, mi, dtype=np.complex64):
     """
     GFSK modulator
-    msg: binary message (0 or 1)
+    msg: binary message (0 or 1), 1D array or 2D array with one message per
+        row (all the messages are modulated at once)
     sps: sample per symbel
     bt: bandwidth time product
     mi: modulation index, phase change in one bit.
+    dtype: output type
 
     the span of Gaussian filter is set to one
+    returns msg.shape[:-1] + (msg.shape[-1] * sps,) samples
     """
-    msg = msg * 2 - 1.0
-    freq = upsample(msg, sps)
-    t = np.arange((-0.5 + 1 / sps / 2), 0.5, 1 / sps)
-    shape = norm.cdf(2 * np.pi * bt * (t + 0.5) / np.sqrt(np.log(2))) - \
-        norm.cdf(2 * np.pi * bt * (t - 0.5) / np.sqrt(np.log(2)))
-    shape = shape / shape.sum()
-    freq = np.convolve(freq, shape)
-    freq = freq[: msg.size * sps]
+    msg = np.asarray(msg) * 2 - 1.0
+    shape = gaussian_pulse(sps, bt)
+    # the pulse spans one symbol, so convolving the upsampled message is
+    # the same as scaling one pulse per symbol
+    freq = (msg[..., None] * shape).reshape(msg.shape[:-1] + (-1,))
+    # phase[n + 1] = phase[n] + mi * pi * freq[n], phase[0] = 0
     phase = np.zeros_like(freq)
-    for idx in range(freq.size - 1):
-        phase[idx + 1] = phase[idx] + mi * np.pi * freq[idx]
-    return np.exp(1j * phase)
+    np.cumsum(mi * np.pi * freq[..., :-1], axis=-1, out=phase[..., 1:])
+    out = np.empty(phase.shape, dtype=dtype)
+    out.real = np.cos(phase)
+    out.imag = np.sin(phase)
+    return out
+
+
+def _benchmark(n_msg=10000, n_bit=100, sps=10, bt=0.3, mi=0.5):
+    """time the batched modulator"""
+    rng = np.random.default_rng(0)
+    msg = rng.integers(2, size=(n_msg, n_bit))
+    tic = time.perf_counter()
+    gfsk_mod(msg, sps, bt, mi)
+    elapsed = time.perf_counter() - tic
+    print('{} bursts of {} bits in {:.3f} s'.format(n_msg, n_bit, elapsed))
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='')
+    parser.add_argument('--benchmark', '-b', action='store_true',
+                        help='time the modulation of 10000 bursts')
+    args = parser.parse_args()
+
     rng = np.random.default_rng()
     msg = rng.integers(2, size=100)
     bt = 0.3
@@ -59,3 +97,5 @@ if __name__ == "__main__":
     x = gfsk_mod(msg, sps, bt, mi)
 
     print(get_c42(x))
+    if args.benchmark:
+        _benchmark()
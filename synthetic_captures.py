@@ -0,0 +1,154 @@
+"""
+synthetic capture corpus for benchmarks and tests
+
+writes valid v1 to v5 capture files made of complex Gaussian noise and GFSK
+bursts at known times and frequency offsets. The ground truth is saved next
+to each capture as <capture>.truth, a json with one entry per burst, in
+physical units (start and duration in ms, band edges in MHz). It is not a
+labelme file: the labelme rectangles of the dataset are in pixels of the
+label images, and a <capture>.json next to the <capture>.jpg of visu_cap
+would be taken for one (e.g. by SpcgDataset, which reads every *.json).
+The files only depend on the seed.
+
+usage: python synthetic_captures.py [target folder] -n 10
+-v [capture version, 5 by default]
+-d [duration in ms, v1 to v3 only support their fixed lengths at 56 MHz]
+-b [number of bursts per capture]
+-s [seed]
+"""
+
+import argparse
+import json
+from pathlib import Path
+import numpy as np
+import utils.signal_file_handler as sfh
+from misc.gfsk_mod_C42 import gfsk_mod
+
+# the old versions are recognised by their payload length at 56 MHz
+FIXED_DURATIONS_MS = {1: (633, 90), 2: (633,), 3: (633, 460, 211)}
+FIXED_FS_KHZ = 56000
+
+
+def make_capture(path, version=5, duration_ms=50, fs_khz=56000,
+                 fc_khz=2440000, sensor_id=1, gain_db=30, num_ant=4,
+                 noise_db=20, n_burst=8, snr_db=(10, 30),
+                 symbol_rate_khz=1000, n_bit=(80, 400), bt=0.5, mi=0.5,
+                 seed=None):
+    """
+    write one synthetic capture and its ground truth
+
+    noise_db: noise power (I^2 + Q^2) in dB, same scale as the power plots
+    snr_db: (min, max) of the burst power above the noise floor
+    n_bit: (min, max) number of bits in a burst
+    returns the ground truth dict, also saved as <capture>.truth
+    """
+    path = Path(path)
+    if version in FIXED_DURATIONS_MS and (
+            fs_khz != FIXED_FS_KHZ
+            or duration_ms not in FIXED_DURATIONS_MS[version]):
+        raise ValueError('v{} captures are {} ms long at {} kHz'.format(
+            version, FIXED_DURATIONS_MS[version], FIXED_FS_KHZ))
+    rng = np.random.default_rng(seed)
+    n_sample = int(duration_ms * fs_khz)
+
+    noise_std = np.sqrt(10 ** (noise_db / 10) / 2)
+    data = np.empty(n_sample, dtype=np.complex64)
+    data.real = rng.normal(0, noise_std, n_sample)
+    data.imag = rng.normal(0, noise_std, n_sample)
+
+    sps = int(round(fs_khz / symbol_rate_khz))
+    # a GFSK burst occupies about (1 + mi) times the symbol rate
+    burst_bw_khz = (1 + mi) * fs_khz / sps
+    max_offset_khz = max(fs_khz * 0.4 - burst_bw_khz / 2, 0)
+    bursts = []
+    for _ in range(n_burst):
+        bits = rng.integers(2, size=rng.integers(n_bit[0], n_bit[1] + 1))
+        burst = gfsk_mod(bits, sps, bt, mi)
+        if len(burst) >= n_sample:
+            continue
+        start = int(rng.integers(n_sample - len(burst)))
+        offset_khz = float(rng.uniform(-max_offset_khz, max_offset_khz))
+        snr = float(rng.uniform(*snr_db))
+        amplitude = np.sqrt(10 ** ((noise_db + snr) / 10))
+        cycles = np.arange(start, start + len(burst)) * (offset_khz / fs_khz)
+        burst *= (amplitude * np.exp(2j * np.pi * (cycles % 1.0))).astype(
+            np.complex64)
+        data[start:start + len(burst)] += burst
+
+        t0_ms = start / fs_khz
+        t1_ms = (start + len(burst)) / fs_khz
+        f_low = (fc_khz + offset_khz - burst_bw_khz / 2) / 1e3
+        f_high = (fc_khz + offset_khz + burst_bw_khz / 2) / 1e3
+        bursts.append({'label': 'gfsk',
+                       'start_ms': t0_ms, 'duration_ms': t1_ms - t0_ms,
+                       'f_low_mhz': f_low, 'f_high_mhz': f_high,
+                       'offset_khz': offset_khz, 'snr_db': snr,
+                       'n_bit': len(bits), 'sps': sps, 'bt': bt, 'mi': mi})
+
+    iq = data.view(np.float32)
+    np.rint(iq, out=iq)
+    np.clip(iq, -32768, 32767, out=iq)
+    data_int16 = iq.astype(np.int16)
+    del data, iq
+
+    ant_dwell_time_ms = max(int(duration_ms // num_ant), 1)
+    ant_seq = sum(idx << (4 * idx) for idx in range(num_ant))
+    header_len = sfh.CaptureHeader.HEADER_V5_SEARCH_LEN_BYTES
+    header = sfh.CaptureHeader(
+        5, header_len + 2 * len(data_int16) - 4, sensor_id, fc_khz, fs_khz,
+        int(fs_khz * 0.8), gain_db, 0, 1, num_ant=num_ant, ant_seq=ant_seq,
+        ant_dwell_time_ms=ant_dwell_time_ms, capture_id=0,
+        capture_mode=sfh.CaptureHeader.CAPTURE_MODE_SEARCH, ant_type=0,
+        angle=0)
+    sfh.CaptureFile(header=header, data=data_int16).save(
+        str(path), version=version)
+
+    truth = {'capture': path.name,
+             'fc_khz': fc_khz,
+             'fs_khz': fs_khz,
+             'duration_ms': n_sample / fs_khz,
+             'noise_db': noise_db,
+             'bursts': bursts}
+    with path.with_suffix('.truth').open('w') as f:
+        json.dump(truth, f, indent=2)
+    return truth
+
+
+def main():
+    parser = argparse.ArgumentParser(description='')
+    parser.add_argument('folder', type=str,
+                        help='folder to save the captures')
+    parser.add_argument('--number', '-n', type=int, default=10,
+                        help='number of captures')
+    parser.add_argument('--version', '-v', type=int, default=5,
+                        choices=[1, 2, 3, 4, 5])
+    parser.add_argument('--duration', '-d', type=float,
+                        help='duration in ms, 50 for v4/v5 by default')
+    parser.add_argument('--fs', type=int, default=56000,
+                        help='sampling rate in kHz')
+    parser.add_argument('--fc', type=float, default=2440,
+                        help='centre frequency in MHz')
+    parser.add_argument('--noise', type=float, default=20,
+                        help='noise power in dB')
+    parser.add_argument('--bursts', '-b', type=int, default=8,
+                        help='number of bursts per capture')
+    parser.add_argument('--seed', '-s', type=int, default=0)
+    args = parser.parse_args()
+
+    duration_ms = args.duration
+    if duration_ms is None:
+        duration_ms = FIXED_DURATIONS_MS.get(args.version, (50,))[-1]
+    folder = Path(args.folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    for idx in range(args.number):
+        path = folder / 'synthetic_v{}_{:04d}.dat'.format(args.version, idx)
+        # one seed per file, a file does not depend on the number of files
+        make_capture(path, version=args.version, duration_ms=duration_ms,
+                     fs_khz=args.fs, fc_khz=int(args.fc * 1e3),
+                     sensor_id=idx, noise_db=args.noise,
+                     n_burst=args.bursts, seed=[args.seed, idx])
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
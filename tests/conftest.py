@@ -0,0 +1,6 @@
+import sys
+from pathlib import Path
+
+# the utils modules import each other as top level modules
+ROOT = Path(__file__).resolve().parents[1]
+sys.path[:0] = [str(ROOT), str(ROOT / 'utils')]
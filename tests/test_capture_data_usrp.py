@@ -0,0 +1,121 @@
+import sys
+import types
+import numpy as np
+import capture_data_usrp as cdu
+import signal_file_handler as sfh
+
+
+class FakeStreamer:
+    """rx streamer of a fake USRP, the samples are a counter"""
+
+    def __init__(self, uhd, chunk=1000, overflow_at=()):
+        self.uhd = uhd
+        self.chunk = chunk
+        self.overflow_at = set(overflow_at)
+        self.n_call = 0
+        self.n_sample = 0
+        self.buffer_sizes = []
+
+    def issue_stream_cmd(self, stream_cmd):
+        pass
+
+    def recv(self, buffer, metadata, timeout):
+        # what UHD expects for sc16: 4 bytes per sample on the last axis
+        assert buffer.ndim == 2 and buffer.shape[0] == 1
+        assert buffer.dtype.itemsize == 4
+        self.buffer_sizes.append(buffer.shape[1])
+        self.n_call += 1
+        codes = self.uhd.types.RXMetadataErrorCode
+        if self.n_call in self.overflow_at:
+            metadata.error_code = codes.overflow
+            return 0
+        metadata.error_code = codes.none
+        n = min(self.chunk, buffer.shape[1])
+        counter = np.arange(self.n_sample, self.n_sample + n)
+        iq = buffer.view(np.int16).reshape(-1, 2)
+        iq[:n, 0] = counter % 32768
+        iq[:n, 1] = -(counter % 32768)
+        self.n_sample += n
+        return n
+
+
+def fake_uhd(streamer_args):
+    uhd = types.SimpleNamespace()
+    uhd.types = types.SimpleNamespace(
+        RXMetadataErrorCode=types.SimpleNamespace(none=0, overflow=8),
+        StreamMode=types.SimpleNamespace(start_cont=1, stop_cont=2),
+        StreamCMD=lambda mode: types.SimpleNamespace(mode=mode),
+        TuneRequest=lambda freq: freq,
+        RXMetadata=lambda: types.SimpleNamespace(error_code=0))
+    devices = []
+
+    class MultiUSRP:
+        def __init__(self, args):
+            devices.append(self)
+            self.streamer = FakeStreamer(uhd, **streamer_args)
+
+        def __getattr__(self, name):
+            # set_rx_rate, set_rx_freq...
+            return lambda *args: None
+
+        def get_rx_stream(self, stream_args):
+            return self.streamer
+
+    uhd.usrp = types.SimpleNamespace(
+        MultiUSRP=MultiUSRP,
+        StreamArgs=lambda cpu, otw: types.SimpleNamespace())
+    return uhd, devices
+
+
+def test_uhd_source_buffer_bounds(tmp_path, monkeypatch):
+    uhd, devices = fake_uhd({'chunk': 1000, 'overflow_at': (3,)})
+    monkeypatch.setitem(sys.modules, 'uhd', uhd)
+    n_samples = 10000
+    source = cdu.UHDSource(2.4e9, 56e6, 25)
+    writer = cdu.CaptureWriter(tmp_path / 'a.dat', n_samples,
+                               buffer_samples=1536, n_buffer=2)
+    stats = writer.record(source)
+    streamer = devices[0].streamer
+    assert stats['samples'] == n_samples
+    assert stats['overflows'] == 1
+    # a recv never gets more room than what is left in the ring slot
+    assert max(streamer.buffer_sizes) <= 1536
+    raw = np.fromfile(str(tmp_path / 'a.dat'), dtype=np.int16)
+    assert raw.size == 2 * n_samples
+    counter = np.arange(n_samples) % 32768
+    assert np.array_equal(raw[0::2], counter)
+    assert np.array_equal(raw[1::2], -counter)
+
+    # the device is opened once, the overflow count restarts
+    stats = writer.record(source)
+    assert len(devices) == 1
+    assert stats['overflows'] == 0
+
+
+def test_uhd_source_clamps_the_received_length(monkeypatch):
+    uhd, devices = fake_uhd({'chunk': 1000})
+    monkeypatch.setitem(sys.modules, 'uhd', uhd)
+    source = cdu.UHDSource(2.4e9, 56e6, 25)
+    source.start()
+    # a streamer returning more samples than asked for
+    devices[0].streamer.recv = lambda buffer, metadata, timeout: \
+        2 * buffer.shape[1]
+    out = np.zeros((100, 2), dtype=np.int16)
+    assert source.read(out) == 100
+
+
+def test_writer_header(tmp_path):
+    n_samples = 5000
+    header = sfh.CaptureHeader(
+        3, 4 * n_samples + sfh.CaptureHeader.HEADER_V3_LEN_BYTES - 4,
+        sensor_id=1, fc_khz=2422300, fs_khz=56e3, bw_khz=55e3, gain_db=25,
+        start_time_ticks=0, tps=1, num_ant=1, ant_seq=0x76543210,
+        ant_dwell_time_ms=211, capture_id=123456, capture_mode=1,
+        drone_search_bitmap=int('F' * 16, 16))
+    writer = cdu.CaptureWriter(tmp_path / 'a.dat', n_samples, header=header,
+                               version=5)
+    stats = writer.record(cdu.SyntheticSource(seed=0))
+    assert stats['samples'] == n_samples
+    capture = sfh.CaptureFile(path=str(tmp_path / 'a.dat'))
+    assert capture.header.header_version == 5
+    assert capture.num_samples == n_samples
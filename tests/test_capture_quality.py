@@ -0,0 +1,38 @@
+import numpy as np
+import signal_file_handler as sfh
+import capture_quality as cq
+
+
+def make_capture(n_sample, fs_khz, num_ant, dwell_ms):
+    header = sfh.CaptureHeader(
+        5, sfh.CaptureHeader.HEADER_V5_SEARCH_LEN_BYTES + 4 * n_sample - 4,
+        1, 2440000, fs_khz, fs_khz, 30, 0, 1, num_ant=num_ant,
+        ant_seq=sum(idx << (4 * idx) for idx in range(num_ant)),
+        ant_dwell_time_ms=dwell_ms, capture_id=0,
+        capture_mode=sfh.CaptureHeader.CAPTURE_MODE_SEARCH, ant_type=0,
+        angle=0)
+    data = np.full(2 * n_sample, 10, dtype=np.int16)
+    return sfh.CaptureFile(header=header, data=data)
+
+
+def test_dwells_shorter_than_a_window():
+    # 1 ms dwells at 20 MHz, shorter than SATURATION_WINDOW_SAMPLES
+    capture = make_capture(8 * 20000, 20000, 8, 1)
+    dwells = cq.saturation_by_dwell(capture, iq_threshold=2047)
+    assert [dwell['antenna'] for dwell in dwells] == list(range(8))
+    assert [dwell['n_window'] for dwell in dwells] == [1] * 8
+    assert [dwell['start_ms'] for dwell in dwells] == list(range(8))
+    assert all(dwell['saturation'] == 0 for dwell in dwells)
+    assert all(dwell['clipping'] == 0 for dwell in dwells)
+
+
+def test_window_across_a_dwell_boundary():
+    capture = make_capture(8 * 20000, 20000, 8, 1)
+    raw = capture.samples(dtype=np.int16)
+    # saturated samples at the end of dwell 2 and the start of dwell 3
+    raw[59990:60010] = 3000
+    dwells = cq.saturation_by_dwell(capture)
+    saturated = [dwell['saturation'] > 0 for dwell in dwells]
+    assert saturated == [False, False, True, True, False, False, False,
+                         False]
+    assert dwells[3]['peak_iq'] == 3000
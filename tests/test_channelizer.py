@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+import channelizer
+
+
+def irregular_chunks(x, rng, max_len):
+    # chunk lengths from 0 to max_len, many shorter than n_band
+    start = 0
+    while start < len(x):
+        stop = start + int(rng.integers(max_len + 1))
+        yield x[start:stop]
+        start = stop
+
+
+@pytest.mark.parametrize('n_band, n_tap_per_band', [(16, 12), (8, 1)])
+@pytest.mark.parametrize('dtype', [np.complex128, np.complex64])
+def test_streaming_irregular_chunks(n_band, n_tap_per_band, dtype):
+    rng = np.random.default_rng(0)
+    n_sample = 200 * n_band + 7
+    x = (rng.normal(size=n_sample) + 1j * rng.normal(size=n_sample)
+         ).astype(dtype)
+    chan = channelizer.StreamingChannelizer(n_band, n_tap_per_band)
+    expected = chan.channelize(x)
+
+    # the first chunk is shorter than n_band
+    chunks = [x[:3]] + list(irregular_chunks(x[3:], rng, 3 * n_band))
+    outputs = list(chan.stream(chunks))
+    assert all(out.shape[1] == n_band for out in outputs)
+    assert any(out.shape[0] == 0 for out in outputs)
+    assert np.array_equal(np.concatenate(outputs), expected)
+
+    bands = [1, n_band - 1]
+    outputs = list(chan.stream(chunks, bands=bands))
+    assert all(out.shape[1] == len(bands) for out in outputs)
+    np.testing.assert_allclose(np.concatenate(outputs), expected[:, bands],
+                               rtol=1e-4, atol=1e-4 * np.abs(expected).max())
+
+
+def test_streaming_chunk_without_a_row():
+    chan = channelizer.StreamingChannelizer(16, 12)
+    assert chan.process(np.ones(64)).shape == (4, 16)
+    assert chan.process(np.ones(5)).shape == (0, 16)
+    # the 5 samples are kept for the next row
+    assert chan.process(np.ones(11)).shape == (1, 16)
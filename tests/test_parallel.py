@@ -0,0 +1,22 @@
+import pytest
+import parallel
+
+
+def inverse(x):
+    return 1 / x
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_failures_are_returned_in_both_modes(jobs):
+    tasks = [(x,) for x in (1, 0, 2, 4)]
+    results = {}
+    errors = {}
+    for (x,), result, err in parallel.process_map(inverse, iter(tasks),
+                                                  jobs=jobs, max_pending=1):
+        if err is None:
+            results[x] = result
+        else:
+            errors[x] = err
+    assert results == {1: 1, 2: 0.5, 4: 0.25}
+    assert list(errors) == [0]
+    assert isinstance(errors[0], ZeroDivisionError)
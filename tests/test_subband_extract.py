@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+import signal_file_handler as sfh
+import subband_extract as se
+import synthetic_captures
+
+
+@pytest.fixture
+def capture(tmp_path):
+    synthetic_captures.make_capture(tmp_path / 'a.dat', duration_ms=5,
+                                    n_burst=2, seed=0)
+    return sfh.CaptureFile(path=str(tmp_path / 'a.dat'), mmap=True)
+
+
+def test_header_matches_the_saved_file(capture, tmp_path):
+    subband = se.extract_subband(capture, 2450000, 5000)
+    header = se.save_subband(capture, tmp_path / 'b.dat', 2450000, 5000)
+    saved = sfh.CaptureFile(path=str(tmp_path / 'b.dat'))
+    assert np.array_equal(saved.samples(dtype=np.int16),
+                          subband.samples(dtype=np.int16))
+    for name in ('header_version', 'total_len', 'header_len', 'fc_khz',
+                 'fs_khz', 'bw_khz', 'dwell_time_ms'):
+        assert getattr(subband.header, name) == getattr(saved.header, name)
+        assert getattr(header, name) == getattr(saved.header, name)
+    assert saved.header.header_version == 5
+    assert saved.num_samples == capture.num_samples // 8
+
+
+def test_decimation_must_divide_fs(capture):
+    with pytest.raises(ValueError):
+        se.extract_subband(capture, 2450000, 5000, decimation=9)
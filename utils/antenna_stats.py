@@ -0,0 +1,147 @@
+"""
+per antenna statistics of captures
+
+the raw int16 payload is split into the antenna dwells of the header
+(num_ant, ant_seq, ant_dwell_time_ms) with a reshape, without copy. The
+dwells are then read side by side, block by block, so every block of every
+antenna goes through one batched FFT. For each antenna: mean power, peak
+magnitude, averaged PSD and occupancy (fraction of the spectrogram cells
+above a threshold, the noise floor + 10 dB by default).
+
+usage: python antenna_stats.py [capture file or folder]
+-n [FFT size, 512 by default]
+"""
+
+import argparse
+from pathlib import Path
+import numpy as np
+import signal_file_handler as sfh
+import spectrogram as spg
+
+# histogram of the spectrogram cells in dB, for the occupancy
+HIST_MIN_DB = -100
+HIST_STEP_DB = 0.5
+HIST_BINS = 500
+
+
+def dwell_segments(capture):
+    """
+    raw int16 data of the dwells, as a (n_dwell, dwell_samples, 2) view
+
+    only the dwells of the antenna sequence are kept. returns the view and
+    the antenna of each dwell
+    """
+    header = capture.header
+    antennas = header.antenna_sequence()
+    dwell_samples = header.antenna_dwell_samples()
+    raw = capture.samples(dtype=np.int16)
+    if dwell_samples == 0 or dwell_samples > len(raw):
+        # no dwell information, or the capture ends in the first dwell
+        dwell_samples = len(raw)
+    n_dwell = min(len(antennas), len(raw) // max(dwell_samples, 1))
+    segments = raw[:n_dwell * dwell_samples].reshape(
+        n_dwell, dwell_samples, 2)
+    return segments, antennas[:n_dwell]
+
+
+def antenna_stats(capture, nfft=512, block_samples=1 << 16,
+                  threshold_db=None, margin_db=10, workers=-1):
+    """
+    statistics of each antenna of a capture
+
+    block_samples: samples of each dwell read at once, rounded to nfft
+    threshold_db: occupancy threshold on the PSD cells, the median cell
+        of the capture + margin_db by default
+    returns a dict keyed by antenna index of dict: n_dwell, power_db
+    (mean I^2 + Q^2), peak (magnitude), psd_db (averaged PSD, fftshifted,
+    see spectrogram.frequencies), occupancy
+    """
+    fs = capture.header.fs_khz / 1e3
+    segments, antennas = dwell_segments(capture)
+    n_dwell, dwell_samples = segments.shape[:2]
+    block_samples = max(block_samples // nfft, 1) * nfft
+
+    sum_power = np.zeros(n_dwell)
+    peak = np.zeros(n_dwell, dtype=np.float32)
+    sum_psd = np.zeros((n_dwell, nfft))
+    n_frame = 0
+    hist = np.zeros((n_dwell, HIST_BINS), dtype=np.int64)
+    for start in range(0, dwell_samples, block_samples):
+        block = segments[:, start:start + block_samples]
+        power = np.square(block, dtype=np.float32).sum(axis=-1)
+        sum_power += power.sum(axis=1, dtype=np.float64)
+        np.maximum(peak, power.max(axis=1), out=peak)
+
+        frames = block.shape[1] // nfft
+        if frames == 0:
+            continue
+        # the dwells one after the other, the frames never overlap two
+        # dwells, one FFT batch for all of them
+        chunk = block[:, :frames * nfft].reshape(-1, 2)
+        spcg = spg.spectrogram(chunk, nfft=nfft, window='hann', fs=fs,
+                               log=False, workers=workers,
+                               batch_frames=n_dwell * frames)
+        spcg = spcg.reshape(nfft, n_dwell, frames)
+        sum_psd += spcg.sum(axis=2, dtype=np.float64).T
+        n_frame += frames
+
+        # cells in dB, in place
+        np.maximum(spcg, np.finfo(np.float32).tiny, out=spcg)
+        np.log10(spcg, out=spcg)
+        spcg *= 10
+        idx = ((spcg - HIST_MIN_DB) / HIST_STEP_DB).astype(np.int64)
+        np.clip(idx, 0, HIST_BINS - 1, out=idx)
+        idx += np.arange(n_dwell)[None, :, None] * HIST_BINS
+        hist += np.bincount(idx.ravel(), minlength=n_dwell * HIST_BINS
+                            ).reshape(n_dwell, HIST_BINS)
+
+    edges = HIST_MIN_DB + HIST_STEP_DB * np.arange(HIST_BINS)
+    if threshold_db is None:
+        total = hist.sum(axis=0)
+        median_bin = np.searchsorted(np.cumsum(total), total.sum() / 2)
+        threshold_db = edges[min(median_bin, HIST_BINS - 1)] + margin_db
+    above = edges >= threshold_db
+
+    stats = {}
+    for antenna in sorted(set(antennas)):
+        # an antenna can have several dwells
+        dwells = [idx for idx, ant in enumerate(antennas) if ant == antenna]
+        n_sample = len(dwells) * dwell_samples
+        psd = sum_psd[dwells].sum(axis=0) / max(len(dwells) * n_frame, 1)
+        ant_hist = hist[dwells].sum(axis=0)
+        stats[antenna] = {
+            'n_dwell': len(dwells),
+            'power_db': float(10 * np.log10(
+                max(sum_power[dwells].sum() / max(n_sample, 1), 1))),
+            'peak': float(np.sqrt(peak[dwells].max())),
+            'psd_db': 10 * np.log10(np.maximum(
+                psd, np.finfo(np.float32).tiny)),
+            'occupancy': float(ant_hist[above].sum()
+                               / max(ant_hist.sum(), 1))}
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='')
+    parser.add_argument('path', type=str,
+                        help='capture file or folder of the captures')
+    parser.add_argument('--nfft', '-n', type=int, default=512)
+    args = parser.parse_args()
+
+    path = Path(args.path)
+    paths = path.rglob('*.dat') if path.is_dir() else [path]
+    for path in paths:
+        capture = sfh.CaptureFile(path=str(path), mmap=True)
+        stats = antenna_stats(capture, nfft=args.nfft)
+        print(path)
+        # strongest antenna first
+        for antenna, entry in sorted(stats.items(),
+                                     key=lambda item: -item[1]['power_db']):
+            print('  antenna {}: power {:.1f} dB, peak {:.0f}, '
+                  'occupancy {:.1f} %'.format(
+                      antenna, entry['power_db'], entry['peak'],
+                      100 * entry['occupancy']))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@ plot the spectrogram of a binary file collected by USRP
 import numpy as np
 import matplotlib.pyplot as plt
 import argparse
+import spectrogram as spg
 
 
 def main():
@@ -18,15 +19,22 @@ def main():
     # file_path = '/home/xiao/usrp_capture/my_device_2020_02_05_16_12_27.dat'
     with open(args.file_path, 'rb') as f:
         raw = np.fromfile(f, dtype=np.int16)
-    data = raw[0::2] + 1j*raw[1::2]
-    power = 20 * np.log10(np.sqrt(np.mean((data * np.conj(data)).real)))
+    # mean of I^2 + Q^2
+    power = 10 * np.log10(2 * np.mean(np.square(raw, dtype=np.float32)))
     print('signal power is {p:3.2f} dB'.format(p=power))
     _, ax = plt.subplots(2, 1, figsize=(9, 6))
-    ax[0].specgram(data, NFFT=512, Fs=args.rate / 1e6, Fc=args.fc / 1e6)
+    rate, fc = args.rate / 1e6, args.fc / 1e6
+    spcg = spg.spectrogram(raw, nfft=512, hop=384, window='hann', fs=rate)
+    duration = spcg.shape[1] * 384 / rate / 1000  # ms
+    ax[0].imshow(spcg, aspect='auto', origin='lower',
+                 extent=(0, duration, fc - rate / 2, fc + rate / 2))
     ax[0].set_xlabel('time (ms)')
     ax[0].set_ylabel('frequency (MHz)')
-    ax[0].set_xticklabels(ax[0].get_xticks() / 1000)
-    ax[1].psd(data, NFFT=1024, Fs=args.rate, Fc=args.fc)
+    ax[1].plot(spg.frequencies(1024, fs=args.rate, fc=args.fc),
+               spg.psd(raw, nfft=1024, fs=args.rate))
+    ax[1].set_xlabel('Frequency')
+    ax[1].set_ylabel('Power Spectral Density (dB/Hz)')
+    ax[1].grid(True)
     plt.show()
 
 
@@ -0,0 +1,199 @@
+"""
+persistent index of the capture headers in a folder tree
+
+the catalog is a SQLite file with one row per capture file. Updating the
+catalog only parses the headers of new or changed files, and queries never
+touch the payloads. Files that are not captures are recorded with null
+header columns, so they are not read again until they change.
+
+usage: python capture_catalog.py [folder path] update
+       python capture_catalog.py [folder path] query --fc 2400 2500
+-d [catalog file, capture_catalog.sqlite in the folder by default]
+"""
+
+import argparse
+import os
+import sqlite3
+from pathlib import Path
+import numpy as np
+import signal_file_handler as sfh
+
+CATALOG_NAME = 'capture_catalog.sqlite'
+# header columns come from the bulk header reader
+HEADER_COLUMNS = sfh.CAPTURE_HEADER_DTYPE.names
+COLUMNS = ('path', 'size', 'mtime') + HEADER_COLUMNS + (
+    'dwell_time_ms', 'start_time')
+
+
+class CaptureCatalog:
+    """SQLite index of capture headers."""
+
+    def __init__(self, db_path):
+        self.db_path = Path(db_path)
+        self.conn = sqlite3.connect(str(self.db_path))
+        self.conn.row_factory = sqlite3.Row
+        columns = ', '.join(
+            ['path TEXT PRIMARY KEY', 'size INTEGER', 'mtime REAL']
+            + ['{} INTEGER'.format(name) for name in HEADER_COLUMNS]
+            + ['dwell_time_ms REAL', 'start_time REAL'])
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS captures ({})'.format(columns))
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS captures_query '
+            'ON captures (fc_khz, sensor_id, start_time)')
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def update(self, folder, pattern='*.dat'):
+        """
+        index the captures under a folder, only new or changed files are read
+
+        files that were removed from the folder are dropped from the catalog.
+        returns the number of (re)indexed captures.
+        """
+        folder = Path(folder).resolve()
+        prefix = os.path.join(str(folder), '')
+        indexed = {
+            row['path']: (row['size'], row['mtime'])
+            for row in self.conn.execute(
+                'SELECT path, size, mtime FROM captures')
+            if row['path'].startswith(prefix)}
+        changed = []
+        for path in folder.rglob(pattern):
+            stat = path.stat()
+            key = str(path)
+            if indexed.pop(key, None) != (stat.st_size, stat.st_mtime):
+                changed.append((key, stat.st_size, stat.st_mtime))
+
+        # whatever is left was not found in the folder anymore
+        self.conn.executemany('DELETE FROM captures WHERE path = ?',
+                              [(path,) for path in indexed])
+
+        headers = sfh.read_capture_headers(
+            [path for path, _, _ in changed], skip_invalid=True)
+        rows = []
+        n_capture = 0
+        for (path, size, mtime), header in zip(changed, headers):
+            if header['header_version'] == 0:
+                # not a capture file, the old row of a file that became
+                # unreadable is replaced too
+                rows.append((path, size, mtime)
+                            + (None,) * (len(COLUMNS) - 3))
+                continue
+            rows.append((path, size, mtime)
+                        + tuple(int(header[name]) for name in HEADER_COLUMNS)
+                        + (_dwell_time_ms(header), _start_time(header)))
+            n_capture += 1
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO captures ({}) VALUES ({})'.format(
+                ', '.join(COLUMNS), ', '.join('?' * len(COLUMNS))), rows)
+        self.conn.commit()
+        return n_capture
+
+    def query(self, fc_khz=None, sensor_id=None, start_time=None,
+              capture_mode=None):
+        """
+        find captures without loading them
+
+        fc_khz: (low, high) range of the centre frequency in kHz
+        sensor_id: a sensor id or a list of sensor ids
+        start_time: (begin, end) range of the capture start time in seconds,
+            either bound can be None
+        capture_mode: CaptureHeader.CAPTURE_MODE_SEARCH or _TRACK
+        returns a list of sqlite3.Row ordered by start time
+        """
+        # rows of the files that are not captures have no header
+        conditions = ['header_version IS NOT NULL']
+        params = []
+        if fc_khz is not None:
+            conditions.append('fc_khz BETWEEN ? AND ?')
+            params += [int(fc_khz[0]), int(fc_khz[1])]
+        if sensor_id is not None:
+            sensor_id = np.atleast_1d(sensor_id)
+            conditions.append('sensor_id IN ({})'.format(
+                ', '.join('?' * sensor_id.size)))
+            params += [int(sid) for sid in sensor_id]
+        if start_time is not None:
+            if start_time[0] is not None:
+                conditions.append('start_time >= ?')
+                params.append(float(start_time[0]))
+            if start_time[1] is not None:
+                conditions.append('start_time <= ?')
+                params.append(float(start_time[1]))
+        if capture_mode is not None:
+            conditions.append('capture_mode = ?')
+            params.append(int(capture_mode))
+
+        sql = 'SELECT * FROM captures WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY start_time, path'
+        return self.conn.execute(sql, params).fetchall()
+
+    def paths(self, **kwargs):
+        """paths of the captures matching `query`"""
+        return [Path(row['path']) for row in self.query(**kwargs)]
+
+
+def _dwell_time_ms(header):
+    # same as CaptureHeader.dwell_time_ms
+    if header['fs_khz'] == 0:
+        return None
+    num_iq_pair = (int(header['total_len']) - int(header['header_len'])
+                   + 4) // 4
+    return num_iq_pair / float(header['fs_khz'])
+
+
+def _start_time(header):
+    # absolute start time in seconds, unknown without ticks per second
+    if header['tps'] == 0:
+        return None
+    return int(header['start_time_ticks']) / int(header['tps'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='')
+    parser.add_argument('folder', type=str,
+                        help='folder of the captures')
+    parser.add_argument('command', choices=['update', 'query'])
+    parser.add_argument('--db', '-d', type=str,
+                        help='catalog file, inside the folder by default')
+    parser.add_argument('--fc', type=float, nargs=2,
+                        help='centre frequency range in MHz')
+    parser.add_argument('--sensor', '-s', type=lambda x: int(x, 0),
+                        nargs='+', help='sensor id(s)')
+    parser.add_argument('--start', type=float,
+                        help='earliest start time in seconds')
+    parser.add_argument('--end', type=float,
+                        help='latest start time in seconds')
+    args = parser.parse_args()
+
+    folder = Path(args.folder)
+    db_path = folder / CATALOG_NAME if args.db is None else Path(args.db)
+    with CaptureCatalog(db_path) as catalog:
+        if args.command == 'update':
+            n_file = catalog.update(folder)
+            print('{} captures indexed'.format(n_file))
+            return
+
+        fc_khz = None
+        if args.fc is not None:
+            fc_khz = (args.fc[0] * 1e3, args.fc[1] * 1e3)
+        start_time = None
+        if args.start is not None or args.end is not None:
+            start_time = (args.start, args.end)
+        for row in catalog.query(fc_khz=fc_khz, sensor_id=args.sensor,
+                                 start_time=start_time):
+            print('{path}  fc: {fc} MHz, SOM {som}, start: {t}'.format(
+                path=row['path'], fc=row['fc_khz'] / 1e3,
+                som=row['sensor_id'], t=row['start_time']))
+
+
+if __name__ == "__main__":
+    main()
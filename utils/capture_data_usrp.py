@@ -4,15 +4,26 @@ This is a stand alone script that captures and saves data using USRP.
 The save format is designed to be compatible with the engineD
 to install matplotlib:
 sudo apt-get install python3-matplotlib
+
+the samples are received in process (UHD python API) and streamed to disk
+by CaptureWriter: the header is written first, the samples go through a
+ring of preallocated buffers to a writer thread. A file or synthetic
+source can replace the USRP for testing:
+python capture_data_usrp.py -s synthetic
+python capture_data_usrp.py -s file --replay capture.dat
 """
 
 import os
-import struct
+import queue
+import threading
 import numpy as np
 import matplotlib.pyplot as plt
 from pathlib import Path
 from datetime import datetime
 import argparse
+import spectrogram as spg
+import power_envelope as pe
+import signal_file_handler as sfh
 
 
 def main():
@@ -53,6 +64,15 @@ def main():
     parser.add_argument(
         '--no_data', '-nd', action='store_true',
         help='don\'t save data file, work with -v')
+    parser.add_argument(
+        '--source', '-s', choices=['uhd', 'file', 'synthetic'],
+        default='uhd', help='optional, source of the samples')
+    parser.add_argument(
+        '--replay', type=str,
+        help='raw int16 I/Q or capture file replayed by the file source')
+    parser.add_argument(
+        '--retry', type=int, default=10,
+        help='optional, number of captures retried after an overflow')
     args = parser.parse_args()
 
     device_name = args.device
@@ -86,72 +106,87 @@ def main():
         else:
             fc_list = args.frequency
 
-    if args.duration == 211:
-        total_len = 47264068
-    elif args.duration == 460:
-        total_len = 103040068
-    elif args.duration == 633:
-        total_len = 141792068
-    else:
+    if args.duration not in (211, 460, 633):
         raise Exception('unsupported duration')
-    if args.no_header:
-        total_len = 0  # no need if no header
+    if args.source == 'file' and args.replay is None:
+        raise Exception('ERROR: the file source needs --replay')
     duration = args.duration / 1000
+    n_samples = int(round(args.rate * duration))
 
     iteration = args.iteration  # repeat times for each fc
     gain = args.gain
+    # one source for all the captures, the USRP is opened once
+    if args.source == 'uhd':
+        source = UHDSource(fc_list[0], args.rate, gain)
+    elif args.source == 'file':
+        source = FileSource(args.replay)
+    else:
+        source = SyntheticSource()
 
     for freq in fc_list:
         for _ in range(iteration):
             date_time = datetime.now().strftime('_%Y_%m_%d_%H_%M_%S')
             file_path = folder / (device_name + date_time + '.dat')
-            usrp_capture([freq, str(args.rate), str(duration),
-                          str(gain)], str(file_path), total_len-68)
+            header = None
+            if not args.no_header:
+                # total_len counts the bytes after its own field
+                total_len = 4 * n_samples \
+                    + sfh.CaptureHeader.HEADER_V3_LEN_BYTES - 4
+                header = sfh.CaptureHeader(
+                    3, total_len, sensor_id=int('1', 16), fc_khz=freq/1000,
+                    fs_khz=56e3, bw_khz=55e3, gain_db=gain,
+                    start_time_ticks=0, tps=1, num_ant=1,
+                    ant_seq=int('76543210', 16),
+                    ant_dwell_time_ms=int(args.duration),
+                    capture_id=123456, capture_mode=1,
+                    drone_search_bitmap=int('FFFFFFFFFFFFFFFF', 16))
+
+            if args.source == 'uhd':
+                source.freq = freq
+            for retry in range(args.retry + 1):
+                writer = CaptureWriter(file_path, n_samples, header=header)
+                stats = writer.record(source)
+                if stats['overflows'] == 0:
+                    break
+                print('capture over flow ({} overflows, {} samples lost), '
+                      'retry'.format(stats['overflows'], stats['lost']))
+            else:
+                raise Exception('capture over flow and retry time out.')
             # if run as root, uncomment the following
             # os.system('chmod 666 {}'.format(str(file_path)))
             if args.visualize:
-                visualize_data(file_path, args.rate, freq, duration, gain)
+                visualize_data(file_path, args.rate, freq, duration, gain,
+                               offset=writer.header_len)
             if args.no_data:
                 file_path.unlink()
-                continue
-            if args.no_header:
-                continue
-
-            header = CaptureHeader(
-                version=3, total_len=total_len, sensor_id=int('1', 16),
-                fc_khz=freq/1000, fs_khz=56e3, bw_khz=55e3, gain_db=gain,
-                start_time_ticks=0, tps=1, num_ant=1,
-                ant_seq=int('76543210', 16),
-                ant_dwell_time_ms=int(args.duration),
-                capture_id=123456, capture_mode=1,
-                drone_search_bitmap=int('FFFFFFFFFFFFFFFF', 16))
-
-            capture = CaptureFile(header=header, path=file_path)
-            capture.save()
 
 
-def visualize_data(file_path, fs, fc, duration, gain):
-    """visualization."""
+def visualize_data(file_path, fs, fc, duration, gain, offset=0):
+    """visualization, offset is the header length."""
     with file_path.open() as f:
-        raw = np.fromfile(f, dtype=np.int16)
-    data = raw[0::2] + 1j*raw[1::2]
-    power = 20 * np.log10(np.sqrt(np.mean((data * data.conj()).real)))
+        raw = np.fromfile(f, dtype=np.int16, offset=offset)
+    # mean of I^2 + Q^2
+    power = 10 * np.log10(2 * np.mean(np.square(raw, dtype=np.float32)))
     # print('digital power is {p:3.2f} dB'.format(p=power))
     _, ax = plt.subplots(3, 1, figsize=(9, 10))
-    ax[0].specgram(data, NFFT=512, Fs=fs/1e6, Fc=fc/1e6)
+    spcg = spg.spectrogram(raw, nfft=512, hop=384, window='hann', fs=fs/1e6)
+    ax[0].imshow(spcg, aspect='auto', origin='lower',
+                 extent=(0, spcg.shape[1] * 384 / fs * 1000,
+                         (fc - fs / 2) / 1e6, (fc + fs / 2) / 1e6))
     ax[0].set_xlabel('time (ms)')
-    ax[0].set_xlim(left=0, right=duration*1e6)
+    ax[0].set_xlim(left=0, right=duration*1e3)
     ax[0].set_ylabel('frequency (MHz)')
-    ax[0].set_xticks(ax[0].get_xticks())
-    ax[0].set_xticklabels(ax[0].get_xticks()/1000)
-    ax[2].psd(data, NFFT=512, Fs=fs/1e6, Fc=fc/1e6, noverlap=0)
+    ax[2].plot(spg.frequencies(512, fs=fs/1e6, fc=fc/1e6),
+               spg.psd(raw, nfft=512, fs=fs/1e6))
     ax[2].set_xlabel('frequency (MHz)')
+    ax[2].set_ylabel('Power Spectral Density (dB/Hz)')
+    ax[2].grid(True)
     ax[2].set_ylim(bottom=10, top=75)
     ax[2].set_yticks(np.arange(10, 75, 10))
-    down_sample = 50
-    data = data[0:-1:down_sample]
-    ax[1].plot(np.arange(data.size) / fs * down_sample * 1000,
-               20 * np.log10(np.abs(data) + 1e-3))
+    # peak power of blocks, short bursts are not dropped
+    envelope = pe.compute_envelope(raw, fs_khz=fs/1e3)
+    time, _, peak, _ = envelope.get(envelope.level_for(5000))
+    ax[1].plot(time, peak)
     ax[1].set_xlim(left=0, right=duration * 1000)
     ax[1].set_ylim(bottom=20, top=100)
     ax[1].axhline(y=93.3, linestyle='--', color='r')
@@ -167,123 +202,219 @@ def visualize_data(file_path, fs, fc, duration, gain):
     # plt.show()
 
 
-def usrp_capture(command_input, file_path, total_len):
-    """Capture data using USRP.
+class UHDSource:
+    """Samples of a USRP, received with the UHD python API (sc16).
 
-    try to support both Linux (os.name == 'posix') and Windows
-    there is still a problem that the stream speed in Windows is not
-    fast enough, so the over_flow detection is disabled.
+    the device and the rx streamer are opened on the first start and
+    reused by the following captures, only the frequency and the gain are
+    set again at each start.
     """
-    if os.name == 'posix':
-        rx_cmd = '/usr/local/lib/uhd/examples/rx_samples_to_file'
-    else:
-        rx_cmd = r'''C:\Program Files\UHD\lib\uhd\examples\
-            rx_samples_to_file.exe'''
-    command = rx_cmd + ' --freq {} --rate {} --duration {} --gain {} \
-        --bw 55e6 --file {}'.format(*command_input, file_path)
-    over_flow = True
-    retry = 0
-    while over_flow:
-        retry = retry + 1
-        if retry > 10:
-            raise Exception('capture over flow and retry time out.')
-        os.system(command)
-        # may more than total_len
-        if os.name == 'posix':
-            over_flow = os.path.getsize(file_path) < total_len
-        else:
-            over_flow = False
-        # print(os.path.getsize(file_path))
-
-
-class CaptureHeader:
-    """Capture header."""
-
-    # 'static' variables
-    header_v1_format = '>IIIIIIQQ'
-    # NOTE: this length includes the 'total_len' field
-    header_v1_len_bytes = 40
-    header_v2_format = '>IIIIIIQQIIII'
-    # NOTE: this length includes the 'total_len' field
-    header_v2_len_bytes = 56
-    header_v3_format = '>IIIIIIQQIQIIIQ'
-    # NOTE: this length includes the 'total_len' field
-    header_v3_len_bytes = 72
-    # NOTE: v4 header length may be variable (?)
-    header_v4_format = '>IIIIIIIIQQQQIIIQIIIQ'
-    payload_byteorder = '<'
-    payload_format = 'h'
-    # v1 and v2 have the same payload length
-    payload_v1_len = 141792000
-    payload_v2_len = 141792000
-    # v3 has three possible payload lengths
-    payload_v3_len_1 = 141792000
-    payload_v3_len_2 = 103040000
-    payload_v3_len_3 = 47264000  # 211 ms total_len=47264068
-    # NOTE: v4 does not have a specified payload length
-
-    def __init__(self, version, total_len, sensor_id, fc_khz, fs_khz, bw_khz,
-                 gain_db, start_time_ticks, tps, num_ant=None, ant_seq=None,
-                 ant_dwell_time_ms=None, capture_id=None, capture_mode=None,
-                 drone_search_bitmap=None, mat=False):
+
+    def __init__(self, freq, rate, gain, bw=55e6, device_args=''):
         """Constructor."""
-        self.header_version = version
+        self.freq = freq
+        self.rate = rate
+        self.gain = gain
+        self.bw = bw
+        self.device_args = device_args
+        self.overflows = 0
+        self.usrp = None
 
-        # fields in the actual file header
-        self.total_len = np.uint32(total_len)
-        self.sensor_id = np.uint32(sensor_id)
-        self.fc_khz = np.uint32(fc_khz)
-        self.fs_khz = np.uint32(fs_khz)
-        self.bw_khz = np.uint32(bw_khz)
-        self.gain_db = np.uint32(gain_db)
-        self.start_time_ticks = np.uint64(start_time_ticks)
-        self.tps = np.uint64(tps)
+    def open(self):
+        """Open the USRP and its rx streamer."""
+        # only needed with a USRP
+        import uhd
+        self._uhd = uhd
+        self.usrp = uhd.usrp.MultiUSRP(self.device_args)
+        self.usrp.set_rx_rate(self.rate, 0)
+        self.usrp.set_rx_bandwidth(self.bw, 0)
+        stream_args = uhd.usrp.StreamArgs('sc16', 'sc16')
+        stream_args.channels = [0]
+        self.streamer = self.usrp.get_rx_stream(stream_args)
+        self.metadata = uhd.types.RXMetadata()
 
-        if self.header_version in (2, 3, 4):
-            self.num_ant = np.uint32(num_ant)
-            self.ant_seq = np.uint32(ant_seq)
-            self.ant_dwell_time_ms = np.uint32(ant_dwell_time_ms)
-            self.capture_id = np.uint32(capture_id)
+    def start(self):
+        """Tune the USRP and start streaming."""
+        if self.usrp is None:
+            self.open()
+        uhd = self._uhd
+        self.overflows = 0
+        self.usrp.set_rx_freq(uhd.types.TuneRequest(self.freq), 0)
+        self.usrp.set_rx_gain(self.gain, 0)
+        stream_cmd = uhd.types.StreamCMD(uhd.types.StreamMode.start_cont)
+        stream_cmd.stream_now = True
+        self.streamer.issue_stream_cmd(stream_cmd)
 
-        if self.header_version in (3, 4):
-            self.capture_mode = np.uint32(capture_mode)
-            self.drone_search_bitmap = np.uint64(drone_search_bitmap)
+    def read(self, out):
+        """Receive up to len(out) samples into out, an (n, 2) int16 view."""
+        n_recv = 0
+        while n_recv < len(out):
+            # one sc16 sample (I and Q) per uint32, UHD takes the number of
+            # samples from the last axis
+            n = self.streamer.recv(
+                out[n_recv:].view(np.uint32).reshape(1, -1),
+                self.metadata, 1.0)
+            error = self.metadata.error_code
+            if error == self._uhd.types.RXMetadataErrorCode.overflow:
+                self.overflows += 1
+            elif error != self._uhd.types.RXMetadataErrorCode.none:
+                raise Exception('UHD receive error: {}'.format(
+                    self.metadata.strerror()))
+            n_recv += min(n, len(out) - n_recv)
+        return n_recv
 
+    def stop(self):
+        """Stop streaming."""
+        stream_cmd = self._uhd.types.StreamCMD(
+            self._uhd.types.StreamMode.stop_cont)
+        self.streamer.issue_stream_cmd(stream_cmd)
 
-class CaptureFile:
-    """Class representation of capture data."""
 
-    def __init__(self, header, path):
+class FileSource:
+    """Samples replayed from a raw int16 I/Q file or a capture file."""
+
+    def __init__(self, path, loop=True):
         """Constructor."""
+        self.path = Path(path)
+        self.loop = loop
+        self.overflows = 0
+
+    def start(self):
+        """Open the file, the header of a capture file is skipped."""
+        try:
+            self.offset = sfh.read_capture_header(self.path).header_len
+        except Exception:
+            # raw samples without header
+            self.offset = 0
+        self.f = self.path.open('rb')
+        self.f.seek(self.offset)
+
+    def read(self, out):
+        """Read up to len(out) samples into out, an (n, 2) int16 view."""
+        buffer = memoryview(out.reshape(-1).view(np.uint8))
+        n_bytes = self.f.readinto(buffer)
+        if n_bytes == 0 and self.loop:
+            self.f.seek(self.offset)
+            n_bytes = self.f.readinto(buffer)
+        return n_bytes // 4
+
+    def stop(self):
+        """Close the file."""
+        self.f.close()
+
+
+class SyntheticSource:
+    """Complex Gaussian noise, for testing without a USRP."""
+
+    def __init__(self, noise_std=100, seed=None):
+        """Constructor."""
+        self.noise_std = noise_std
+        self.seed = seed
+        self.overflows = 0
+
+    def start(self):
+        """Reset the generator."""
+        self.rng = np.random.default_rng(self.seed)
+
+    def read(self, out):
+        """Fill out, an (n, 2) int16 view."""
+        out[:] = self.rng.normal(0, self.noise_std, out.shape)
+        return len(out)
+
+    def stop(self):
+        """Nothing to release."""
+
+
+class CaptureWriter:
+    """Stream the samples of a source to a capture file.
+
+    The header is written first, with the final length, then the samples
+    are received into a ring of preallocated buffers and written by a
+    thread, so receiving never waits for the disk unless the whole ring is
+    full. A capture is a single pass over the data.
+    """
+
+    def __init__(self, path, n_samples, header=None, version=None,
+                 buffer_samples=1 << 18, n_buffer=16):
+        """Constructor.
+
+        header: sfh.CaptureHeader of the capture, raw samples without
+            header if None
+        version: header version, the header version by default
+        """
+        self.path = Path(path)
+        self.n_samples = int(n_samples)
         self.header = header
-        self.path = path
-
-    def save(self):
-        """Save."""
-        with self.path.open('r+b') as f:
-            raw_data = f.read()
-            f.seek(0)
-            # pack bytes in header
-            header_bytes \
-                = struct.pack(self.header.header_v3_format,
-                              self.header.total_len,
-                              self.header.sensor_id,
-                              self.header.fc_khz,
-                              self.header.fs_khz,
-                              self.header.bw_khz,
-                              self.header.gain_db,
-                              self.header.start_time_ticks,
-                              self.header.tps,
-                              self.header.num_ant,
-                              self.header.ant_seq,
-                              self.header.ant_dwell_time_ms,
-                              self.header.capture_id,
-                              self.header.capture_mode,
-                              self.header.drone_search_bitmap)
-            f.write(header_bytes)
-            # pack bytes in payload
-
-            f.write(raw_data)
+        self.version = version
+        self.buffers = np.empty((n_buffer, buffer_samples, 2),
+                                dtype=np.int16)
+        self.header_len = 0
+
+    def record(self, source):
+        """Capture n_samples samples of the source.
+
+        Returns a dict: samples (written), overflows (of the source), lost
+        (samples missing at the end of the stream), ring_full (number of
+        times the receiver had to wait for the writer)
+        """
+        free = queue.Queue()
+        full = queue.Queue()
+        for idx in range(len(self.buffers)):
+            free.put(idx)
+        errors = []
+
+        with self.path.open('wb') as f:
+            if self.header is not None:
+                version = self.version or self.header.header_version
+                header_bytes = sfh.CaptureFile(
+                    header=self.header, data=np.zeros(0, np.int16)
+                ).header_bytes(2 * self.n_samples, version=version)
+                f.write(header_bytes)
+                self.header_len = len(header_bytes)
+
+            def write():
+                while True:
+                    item = full.get()
+                    if item is None:
+                        return
+                    idx, n = item
+                    try:
+                        f.write(memoryview(self.buffers[idx, :n]))
+                    except Exception as err:
+                        errors.append(err)
+                    free.put(idx)
+
+            writer = threading.Thread(target=write)
+            writer.start()
+            n_written = 0
+            ring_full = 0
+            source.start()
+            try:
+                while n_written < self.n_samples:
+                    try:
+                        idx = free.get_nowait()
+                    except queue.Empty:
+                        ring_full += 1
+                        idx = free.get()
+                    n = min(self.buffers.shape[1], self.n_samples - n_written)
+                    n = source.read(self.buffers[idx, :n])
+                    if n == 0:
+                        free.put(idx)
+                        break
+                    full.put((idx, n))
+                    n_written += n
+            finally:
+                source.stop()
+                full.put(None)
+                writer.join()
+        if errors:
+            raise errors[0]
+
+        lost = self.n_samples - n_written
+        return {'samples': n_written,
+                'overflows': source.overflows + (lost > 0),
+                'lost': lost,
+                'ring_full': ring_full}
 
 
 if __name__ == '__main__':
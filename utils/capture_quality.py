@@ -1,53 +1,292 @@
 """
 capture quality evaluation
+
+usage: python capture_quality.py [capture file] -f saturation
+-t [magnitude threshold of the saturation, 2262 by default]
+--iq_threshold [ADC clipping level of I or Q, not checked by default]
+
+       python capture_quality.py [folder or catalog] -f report
+-o [csv table, capture_quality.csv in the folder by default]
+-j [number of worker processes, 1 by default]
 """
 
 import numpy as np
+import cumulants
 import argparse
+import csv
+import os
+from pathlib import Path
+import signal_file_handler as sfh
+import power_envelope as pe
+import capture_catalog
+import parallel
+
+REPORT_NAME = 'capture_quality.csv'
+METRIC_COLUMNS = ('saturation', 'power_db', 'noise_floor_db', 'dc_i',
+                  'dc_q', 'c42')
+REPORT_COLUMNS = ('path', 'mtime') + sfh.CAPTURE_HEADER_DTYPE.names \
+    + METRIC_COLUMNS
+
+# thr = 1600*1.41
+SATURATION_THRESHOLD = 2262
+# 500 samples of the old decimation by 56, 0.5 ms at 56 MHz
+SATURATION_WINDOW_SAMPLES = 28000
+
+
+def saturation_windows(source, window_samples=SATURATION_WINDOW_SAMPLES,
+                       chunk_windows=64):
+    """
+    peak of every window of a capture, at full rate
+
+    source: CaptureFile (its raw int16 data is streamed), int16 I/Q (flat
+        or (n, 2)) or complex samples
+    window_samples: number of samples in a window, the last window can be
+        shorter
+    returns the peak |I| or |Q| and the peak magnitude of each window
+    """
+    peak_iq, peak_mag = [], []
+    for chunk in sfh.iter_chunks(source, window_samples * chunk_windows):
+        if chunk.dtype != np.int16:
+            # complex samples as I/Q columns
+            chunk = np.stack((chunk.real, chunk.imag), axis=-1)
+        n_whole = len(chunk) // window_samples
+        windows = [chunk[:n_whole * window_samples].reshape(
+            n_whole, 2 * window_samples)]
+        if n_whole * window_samples < len(chunk):
+            windows.append(chunk[n_whole * window_samples:].reshape(1, -1))
+        for window in windows:
+            if window.size == 0:
+                continue
+            # max of |I| and |Q| without abs, -(-32768) overflows int16
+            peak_iq.append(np.maximum(
+                window.max(axis=1).astype(np.float32),
+                -window.min(axis=1).astype(np.float32)))
+            power = np.square(window, dtype=np.float32)
+            power = power[:, 0::2] + power[:, 1::2]
+            peak_mag.append(np.sqrt(power.max(axis=1)))
+
+    if not peak_iq:
+        return np.zeros(0, np.float32), np.zeros(0, np.float32)
+    return np.concatenate(peak_iq), np.concatenate(peak_mag)
+
 
+def detect_saturation(data, threshold=SATURATION_THRESHOLD,
+                      window_samples=SATURATION_WINDOW_SAMPLES):
+    """
+    detect a capture is saturated
+
+    data: CaptureFile, raw int16 I/Q or complex samples, every sample is
+        checked
+    returns the fraction of the windows with a peak magnitude above the
+    threshold
+    """
+    _, peak_mag = saturation_windows(data, window_samples)
+    return np.sum(peak_mag > threshold) / max(peak_mag.size, 1)
 
-def detect_saturation(data):
+
+def saturation_by_dwell(capture, threshold=SATURATION_THRESHOLD,
+                        iq_threshold=None,
+                        window_samples=SATURATION_WINDOW_SAMPLES):
     """
-    detect a capture (complex-value) is saturated
+    saturation of every antenna dwell of a capture
+
+    the windows are cut in each dwell, so a window never spans two dwells
+    and a dwell shorter than a window is one (shorter) window
+    iq_threshold: ADC clipping level, |I| or |Q| reaching it is counted as
+        clipping, not checked if None
+    returns a list of dict per dwell: antenna (None after the antenna
+    sequence), start_ms, saturation (fraction of the windows above
+    threshold), clipping (same with iq_threshold), peak_iq, peak_mag and
+    n_window. The ratios and peaks are NaN for a dwell without samples
     """
-    # decimation
-    decim_factor = 56
-    data = data[0: -1: decim_factor]
-    # max downsampling (max pooling)
-    window_size = 500
-    n_window = np.floor(data.size / window_size)
-    data_reshape = np.reshape(data[0: int(window_size * n_window)],
-                              [window_size, -1])
-    data_max = np.max(np.abs(data_reshape), axis=0)
-    # thr = 1600*1.41
-    return np.sum(data_max > 2262) / data_max.size
+    header = capture.header
+    raw = capture.samples(dtype=np.int16)
+    antennas = header.antenna_sequence()
+    dwell_samples = header.antenna_dwell_samples() or len(raw)
+
+    dwells = []
+    for idx, start in enumerate(range(0, len(raw), max(dwell_samples, 1))):
+        peak_iq, peak_mag = saturation_windows(
+            raw[start:start + dwell_samples], window_samples)
+        dwells.append({
+            'antenna': antennas[idx] if idx < len(antennas) else None,
+            'start_ms': start / float(header.fs_khz),
+            'saturation': _ratio(peak_mag > threshold),
+            'clipping': None if iq_threshold is None
+            else _ratio(peak_iq >= iq_threshold),
+            'peak_iq': _peak(peak_iq),
+            'peak_mag': _peak(peak_mag),
+            'n_window': peak_mag.size})
+    return dwells
+
+
+def _ratio(mask):
+    # fraction of True, NaN without windows
+    return float(np.mean(mask)) if mask.size else np.nan
+
+
+def _peak(peaks):
+    return float(peaks.max()) if peaks.size else np.nan
+
+
+def quality_metrics(capture, threshold=SATURATION_THRESHOLD,
+                    noise_percentile=10):
+    """
+    quality metrics of a capture, in one pass over the raw data (and one
+    more for the power envelope if the capture has no sidecar yet)
+
+    returns a dict: saturation (fraction of the windows above threshold),
+    power_db (mean I^2 + Q^2 in dB), noise_floor_db (percentile of the
+    envelope block powers in dB), dc_i and dc_q (mean of I and Q) and c42
+    """
+    accumulator = cumulants.CumulantAccumulator()
+    peak_mag = []
+    for chunk in capture.iter_blocks(SATURATION_WINDOW_SAMPLES * 64,
+                                     dtype=np.int16):
+        accumulator.update(chunk)
+        peak_mag.append(saturation_windows(chunk)[1])
+    peak_mag = np.concatenate(peak_mag) if peak_mag else np.zeros(0)
+
+    envelope = pe.get_envelope(capture)
+    means = envelope.means[0]
+    noise_floor = np.percentile(means, noise_percentile) if means.size \
+        else 0
+    mean = accumulator.mean
+    return {
+        'saturation': float(np.sum(peak_mag > threshold)
+                            / max(peak_mag.size, 1)),
+        'power_db': float(pe.to_db(accumulator.sum_a
+                                   / max(accumulator.n, 1))),
+        'noise_floor_db': float(pe.to_db(noise_floor)),
+        'dc_i': float(mean.real),
+        'dc_q': float(mean.imag),
+        'c42': float(accumulator.c42())}
+
+
+def _report_row(path, threshold):
+    # one row of the report, run in the worker processes
+    capture = sfh.CaptureFile(path=str(path), mmap=True)
+    row = {'path': str(path), 'mtime': repr(Path(path).stat().st_mtime)}
+    for name in sfh.CAPTURE_HEADER_DTYPE.names:
+        value = getattr(capture.header, name, None)
+        row[name] = '' if value is None else int(value)
+    row.update(quality_metrics(capture, threshold=threshold))
+    return row
+
+
+def quality_report(paths, report_path, jobs=1,
+                   threshold=SATURATION_THRESHOLD):
+    """
+    write the quality metrics and header fields of captures in a csv table
+
+    rows of an existing table are reused when the path and the modification
+    time did not change, so only new or modified captures are processed.
+    returns the number of processed captures
+    """
+    report_path = Path(report_path)
+    cached = {}
+    if report_path.exists():
+        with report_path.open(newline='') as f:
+            for row in csv.DictReader(f):
+                cached[row['path']] = row
+
+    rows = {}
+    todo = []
+    for path in paths:
+        path = str(path)
+        try:
+            mtime = repr(os.stat(path).st_mtime)
+        except OSError as err:
+            # e.g. removed since the catalog was updated
+            print('{}: skipped, {!r}'.format(path, err))
+            continue
+        row = cached.get(path)
+        if row is not None and row['mtime'] == mtime:
+            rows[path] = row
+        else:
+            todo.append(path)
+
+    for (path, _), result, err in parallel.process_map(
+            _report_row, ((path, threshold) for path in todo), jobs=jobs):
+        if err is not None:
+            print('{}: failed, {!r}'.format(path, err))
+            continue
+        rows[path] = result
+        print('{}: saturation {:.1f} %, power {:.1f} dB'.format(
+            path, 100 * result['saturation'], result['power_db']))
+
+    with report_path.open('w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS)
+        writer.writeheader()
+        for path in sorted(rows):
+            writer.writerow(rows[path])
+    return len(todo)
 
 
 def get_c42(x):
-    def moment(x, p, q):
-        return np.mean(x ** (p - q) * np.conj(x) ** q)
-    x -= np.mean(x)
-    c21 = moment(x, 2, 1).real
-    c42 = moment(x, 4, 2) - np.abs(moment(x, 2, 0)
-                                   ) ** 2 - 2 * moment(x, 2, 1) ** 2
-    c42 = c42.real / c21 ** 2
-    return c42
+    """
+    normalized C42 of a signal, see cumulants.CumulantAccumulator
+
+    x is not modified, int16 I/Q and capture files are accepted
+    """
+    return cumulants.c42(x)
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument('file_path', type=str)
+    parser.add_argument('file_path', type=str,
+                        help='capture file, or folder / catalog for report')
     parser.add_argument('--function', '-f',
-                        choices=['saturation', 'background'])
+                        choices=['saturation', 'background', 'report'])
+    parser.add_argument('--threshold', '-t', type=float,
+                        default=SATURATION_THRESHOLD,
+                        help='magnitude threshold of the saturation')
+    parser.add_argument('--iq_threshold', type=float,
+                        help='ADC clipping level of I or Q')
+    parser.add_argument('--output', '-o', type=str,
+                        help='csv table of the report')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='number of captures processed in parallel')
     args = parser.parse_args()
 
     if args.function == 'saturation':
-        satu = detect_saturation(args.file_path)
-        print('saturation index: {0:2.1f}'.format(satu))
+        capture = sfh.CaptureFile(path=args.file_path, mmap=True)
+        dwells = saturation_by_dwell(capture, threshold=args.threshold,
+                                     iq_threshold=args.iq_threshold)
+        for dwell in dwells:
+            line = 'dwell at {:.1f} ms, antenna {}: saturation {:.1f} %, ' \
+                'peak |I|/|Q| {:.0f}, peak magnitude {:.0f}'.format(
+                    dwell['start_ms'], dwell['antenna'],
+                    100 * dwell['saturation'], dwell['peak_iq'],
+                    dwell['peak_mag'])
+            if dwell['clipping'] is not None:
+                line += ', clipping {:.1f} %'.format(100 * dwell['clipping'])
+            print(line)
+        # same as detect_saturation, in percent
+        satu = 100 * sum(d['saturation'] * d['n_window'] for d in dwells) \
+            / max(sum(d['n_window'] for d in dwells), 1)
+        print('saturation index: {0:2.1f} %'.format(satu))
         if satu > 10:
             print('capture satruated')
         elif satu > 2:
             print('signal saturated')
         else:
             print('no satruration found')
+    elif args.function == 'report':
+        source = Path(args.file_path)
+        if source.is_dir():
+            paths = sorted(source.rglob('*.dat'))
+            folder = source
+        else:
+            # catalog of capture_catalog.py
+            with capture_catalog.CaptureCatalog(source) as catalog:
+                paths = catalog.paths()
+            folder = source.parent
+        report_path = folder / REPORT_NAME if args.output is None \
+            else Path(args.output)
+        n_file = quality_report(paths, report_path, jobs=args.jobs,
+                                threshold=args.threshold)
+        print('{} captures processed, {} in {}'.format(
+            n_file, len(paths), report_path))
     else:
         print('function nor given or not supported')
@@ -0,0 +1,149 @@
+"""
+one pass estimation of the second and fourth order cumulants (C21, C42)
+
+the raw moments sum(x), sum(x^2), sum(|x|^2), sum(|x|^2 x) and
+sum(|x|^4) are accumulated chunk by chunk in float64, the mean is removed
+exactly from the raw moments at the end, so the input is never centred in
+place or copied as a whole. The input can be complex samples, the raw int16
+I/Q of a capture, or a CaptureFile (streamed with iter_blocks).
+
+C42 is normalized by C21^2 like get_c42. For a constant envelope it is
+-1 - |C20|^2 / C21^2: about -1 for FSK, GFSK and QPSK (C20 = 0), -2 for
+BPSK (|C20| = C21), and 0 for Gaussian noise.
+"""
+
+import numpy as np
+import signal_file_handler as sfh
+
+
+class CumulantAccumulator:
+    """running raw moments of a complex signal"""
+
+    def __init__(self):
+        self.n = 0
+        self.sum_x = 0j
+        self.sum_x2 = 0j
+        self.sum_a = 0.0
+        self.sum_ax = 0j
+        self.sum_a2 = 0.0
+
+    def update(self, x):
+        """add samples (complex, or int16 I/Q flat or (n, 2))"""
+        for chunk in sfh.iter_chunks(x):
+            sums = _raw_sums(chunk)
+            self.n += sums[0]
+            self.sum_x += sums[1]
+            self.sum_x2 += sums[2]
+            self.sum_a += sums[3]
+            self.sum_ax += sums[4]
+            self.sum_a2 += sums[5]
+        return self
+
+    def merge(self, other):
+        """add the moments of another accumulator, e.g. from another worker"""
+        self.n += other.n
+        self.sum_x += other.sum_x
+        self.sum_x2 += other.sum_x2
+        self.sum_a += other.sum_a
+        self.sum_ax += other.sum_ax
+        self.sum_a2 += other.sum_a2
+        return self
+
+    @property
+    def mean(self):
+        return self.sum_x / max(self.n, 1)
+
+    def c20(self):
+        return _cumulants(self.n, self.sum_x, self.sum_x2, self.sum_a,
+                          self.sum_ax, self.sum_a2)[0]
+
+    def c21(self):
+        return _cumulants(self.n, self.sum_x, self.sum_x2, self.sum_a,
+                          self.sum_ax, self.sum_a2)[1]
+
+    def c42(self):
+        """C42 normalized by C21^2"""
+        return _cumulants(self.n, self.sum_x, self.sum_x2, self.sum_a,
+                          self.sum_ax, self.sum_a2)[2]
+
+
+def c42(x):
+    """normalized C42 of a signal, the input is not modified"""
+    return CumulantAccumulator().update(x).c42()
+
+
+def c42_track(source, window_samples, fs_khz=None):
+    """
+    C21 and normalized C42 over consecutive windows
+
+    source: complex samples, raw int16 I/Q, or a CaptureFile
+    window_samples: number of samples per window, the samples after the
+        last whole window are ignored
+    fs_khz: sampling rate for the time axis, taken from the capture header
+        by default, the time is the window index without one
+    returns time (ms) of the window starts, c21 and c42 arrays
+    """
+    window_samples = int(window_samples)
+    if fs_khz is None and hasattr(source, 'header'):
+        fs_khz = float(source.header.fs_khz)
+    # whole windows in each chunk
+    chunk_samples = max(sfh.CHUNK_SAMPLES // window_samples, 1) \
+        * window_samples
+
+    c21s, c42s = [], []
+    for chunk in sfh.iter_chunks(source, chunk_samples):
+        n_window = len(chunk) // window_samples
+        if n_window == 0:
+            continue
+        chunk = chunk[:n_window * window_samples]
+        chunk = chunk.reshape((n_window, window_samples) + chunk.shape[1:])
+        _, c21, c42 = _cumulants(*_raw_sums(chunk, axis=1))
+        c21s.append(c21)
+        c42s.append(c42)
+
+    c21 = np.concatenate(c21s) if c21s else np.zeros(0)
+    c42 = np.concatenate(c42s) if c42s else np.zeros(0)
+    time = np.arange(len(c21)) * float(window_samples)
+    if fs_khz:
+        time /= fs_khz
+    return time, c21, c42
+
+
+def _raw_sums(x, axis=0):
+    """n, sum(x), sum(x^2), sum(|x|^2), sum(|x|^2 x), sum(|x|^4)"""
+    if x.dtype == np.int16:
+        re = x[..., 0].astype(np.float64)
+        im = x[..., 1].astype(np.float64)
+    else:
+        re = np.real(x).astype(np.float64)
+        im = np.imag(x).astype(np.float64)
+    a = np.square(re)
+    a += np.square(im)
+    sum_x = re.sum(axis=axis) + 1j * im.sum(axis=axis)
+    # x^2 = re^2 - im^2 + 2j re im
+    sum_x2 = (2 * np.square(re).sum(axis=axis) - a.sum(axis=axis)
+              + 2j * (re * im).sum(axis=axis))
+    sum_ax = (a * re).sum(axis=axis) + 1j * (a * im).sum(axis=axis)
+    return (re.shape[axis], sum_x, sum_x2, a.sum(axis=axis), sum_ax,
+            np.square(a).sum(axis=axis))
+
+
+def _cumulants(n, sum_x, sum_x2, sum_a, sum_ax, sum_a2):
+    """C20, C21 and normalized C42 of the centred signal"""
+    n = np.maximum(n, 1)
+    mu = sum_x / n
+    m_x2 = sum_x2 / n
+    m_a = sum_a / n
+    m_ax = sum_ax / n
+    m_a2 = sum_a2 / n
+    mu_a = np.abs(mu) ** 2
+
+    # moments of y = x - mu
+    c20 = m_x2 - mu ** 2
+    c21 = m_a - mu_a
+    m_y4 = (m_a2 - 4 * np.real(m_ax * np.conj(mu)) + 4 * mu_a * m_a
+            + 2 * np.real(m_x2 * np.conj(mu) ** 2) - 3 * mu_a ** 2)
+    c42 = m_y4 - np.abs(c20) ** 2 - 2 * c21 ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        c42 = c42 / c21 ** 2
+    return c20, c21, c42
@@ -0,0 +1,147 @@
+"""
+DC offset and IQ imbalance estimation and correction
+
+the estimator accumulates the first and second order moments of I and Q in
+one pass (chunk by chunk, float64), assuming the received signal has
+uncorrelated I and Q of equal power, which holds for noise and most
+signals over a whole capture. The imbalance is modelled on Q:
+
+    Q = g * (Q0 * cos(phi) + I0 * sin(phi)) + dc_q,  I = I0 + dc_i
+
+the correction is applied block by block, so a corrected copy of the
+capture is never written.
+
+usage: python iq_correction.py [capture file or folder]
+"""
+
+import argparse
+from pathlib import Path
+import numpy as np
+import signal_file_handler as sfh
+
+
+class IQStatistics:
+    """running moments of I and Q"""
+
+    def __init__(self):
+        self.n = 0
+        self.sum_i = 0.0
+        self.sum_q = 0.0
+        self.sum_ii = 0.0
+        self.sum_qq = 0.0
+        self.sum_iq = 0.0
+
+    def update(self, x):
+        """add samples (complex, or int16 I/Q flat or (n, 2))"""
+        for chunk in sfh.iter_chunks(x):
+            i, q = _split_iq(chunk, np.float64)
+            self.n += len(i)
+            self.sum_i += i.sum()
+            self.sum_q += q.sum()
+            self.sum_ii += np.dot(i, i)
+            self.sum_qq += np.dot(q, q)
+            self.sum_iq += np.dot(i, q)
+        return self
+
+    def merge(self, other):
+        """add the moments of another IQStatistics"""
+        self.n += other.n
+        self.sum_i += other.sum_i
+        self.sum_q += other.sum_q
+        self.sum_ii += other.sum_ii
+        self.sum_qq += other.sum_qq
+        self.sum_iq += other.sum_iq
+        return self
+
+    def correction(self):
+        """IQCorrection estimated from the moments"""
+        n = max(self.n, 1)
+        dc_i = self.sum_i / n
+        dc_q = self.sum_q / n
+        var_i = self.sum_ii / n - dc_i ** 2
+        var_q = self.sum_qq / n - dc_q ** 2
+        cov = self.sum_iq / n - dc_i * dc_q
+        if var_i <= 0 or var_q <= 0:
+            return IQCorrection(dc_i, dc_q)
+        gain = np.sqrt(var_q / var_i)
+        phase = np.arcsin(np.clip(cov / np.sqrt(var_i * var_q), -1, 1))
+        return IQCorrection(dc_i, dc_q, gain, phase)
+
+
+class IQCorrection:
+    """DC offset and IQ imbalance of a receiver, and their correction"""
+
+    def __init__(self, dc_i=0.0, dc_q=0.0, gain=1.0, phase=0.0):
+        self.dc_i = float(dc_i)
+        self.dc_q = float(dc_q)
+        self.gain = float(gain)
+        self.phase = float(phase)
+
+    @property
+    def gain_db(self):
+        return 20 * np.log10(self.gain)
+
+    @property
+    def phase_deg(self):
+        return np.degrees(self.phase)
+
+    def apply(self, block, dtype=np.complex64):
+        """
+        corrected complex samples of a block (complex, or int16 I/Q flat or
+        (n, 2)), the input is not modified
+        """
+        i, q = _split_iq(np.asarray(block), np.float32)
+        out = np.empty(len(i), dtype=dtype)
+        out.real = i
+        out.real -= self.dc_i
+        # Q0 = ((Q - dc_q) / g - I0 sin(phi)) / cos(phi)
+        q = q - self.dc_q
+        q *= 1 / (self.gain * np.cos(self.phase))
+        q -= np.tan(self.phase) * out.real
+        out.imag = q
+        return out
+
+    def iter_blocks(self, capture, block_samples, overlap=0,
+                    dtype=np.complex64):
+        """CaptureFile.iter_blocks with the correction applied"""
+        for block in capture.iter_blocks(block_samples, overlap=overlap,
+                                         dtype=np.int16):
+            yield self.apply(block, dtype=dtype)
+
+    def __repr__(self):
+        return ('IQCorrection: dc ({:.2f}, {:.2f}), gain {:.3f} dB, '
+                'phase {:.3f} deg'.format(self.dc_i, self.dc_q,
+                                          self.gain_db, self.phase_deg))
+
+
+def estimate_correction(source):
+    """
+    estimate the correction of a CaptureFile (its raw int16 data is
+    streamed) or of samples
+    """
+    return IQStatistics().update(source).correction()
+
+
+def _split_iq(block, dtype):
+    """I and Q of a block as two arrays of dtype"""
+    if block.dtype == np.int16:
+        block = block.reshape(-1, 2)
+        return block[:, 0].astype(dtype), block[:, 1].astype(dtype)
+    return block.real.astype(dtype), block.imag.astype(dtype)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='')
+    parser.add_argument('path', type=str,
+                        help='capture file or folder of the captures')
+    args = parser.parse_args()
+
+    path = Path(args.path)
+    paths = path.rglob('*.dat') if path.is_dir() else [path]
+    for path in paths:
+        capture = sfh.CaptureFile(path=str(path), mmap=True)
+        print('{}: {}'.format(path, estimate_correction(capture)))
+
+
+if __name__ == "__main__":
+    main()
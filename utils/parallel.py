@@ -0,0 +1,52 @@
+"""
+run a function over many captures, in worker processes or in this process
+
+the number of submitted tasks is bounded (2 * jobs by default), so the
+memory use does not depend on the number of files when the tasks are read
+lazily. Serial and parallel runs report a failed task the same way: its
+exception is returned with the task, the other tasks still run.
+"""
+
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures import FIRST_COMPLETED, ALL_COMPLETED
+
+
+def process_map(func, tasks, jobs=1, max_pending=None):
+    """
+    call func(*task) for each task
+
+    func: picklable function (module level, or functools.partial of one)
+    tasks: iterable of argument tuples
+    jobs: number of worker processes, func runs in this process if <= 1
+    max_pending: number of tasks submitted ahead, 2 * jobs by default
+    yields (task, result, error) in completion order, error is the raised
+    exception (result is None) or None
+    """
+    if jobs <= 1:
+        for task in tasks:
+            try:
+                yield task, func(*task), None
+            except Exception as err:
+                yield task, None, err
+        return
+
+    if max_pending is None:
+        max_pending = 2 * jobs
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending = {}
+
+        def collect(return_when):
+            done, _ = wait(pending, return_when=return_when)
+            for future in done:
+                task = pending.pop(future)
+                try:
+                    yield task, future.result(), None
+                except Exception as err:
+                    yield task, None, err
+
+        for task in tasks:
+            if len(pending) >= max_pending:
+                yield from collect(FIRST_COMPLETED)
+            pending[pool.submit(func, *task)] = task
+        if pending:
+            yield from collect(ALL_COMPLETED)
@@ -0,0 +1,197 @@
+"""
+multi-resolution min/max/mean power envelope of captures
+
+the envelope is computed in one streaming pass over the raw int16 payload
+and saved as a small sidecar next to the capture (<name>.env.npz). Level 0
+keeps the min, max and mean of I^2 + Q^2 over blocks of `block_samples`
+samples, each next level merges `factor` blocks of the previous one. Plots
+and triage queries read the level matching their zoom instead of the
+payload. Unlike stride decimation, the max of every level keeps the peak
+of every burst.
+
+usage: python power_envelope.py [folder path]
+--above [report the captures with a peak above this power in dB]
+"""
+
+import argparse
+from pathlib import Path
+import numpy as np
+import signal_file_handler as sfh
+
+SIDECAR_SUFFIX = '.env.npz'
+
+
+class PowerEnvelope:
+    """pyramid of per-block min/max/mean power"""
+
+    def __init__(self, mins, maxs, means, block_samples, factor, fs_khz):
+        self.mins = mins
+        self.maxs = maxs
+        self.means = means
+        self.block_samples = block_samples
+        self.factor = factor
+        self.fs_khz = fs_khz
+
+    @property
+    def n_level(self):
+        return len(self.maxs)
+
+    def level_block_samples(self, level):
+        """number of samples in one block of a level"""
+        return self.block_samples * self.factor ** level
+
+    def level_for(self, max_points):
+        """finest level with no more than max_points blocks"""
+        for level in range(self.n_level):
+            if len(self.maxs[level]) <= max_points:
+                return level
+        return self.n_level - 1
+
+    def get(self, level=0, db=True):
+        """
+        time (ms) of the block starts, min, max and mean power of a level
+        """
+        block = self.level_block_samples(level)
+        time = np.arange(len(self.maxs[level])) * block / self.fs_khz
+        levels = (self.mins[level], self.maxs[level], self.means[level])
+        if db:
+            levels = tuple(to_db(x) for x in levels)
+        return (time,) + levels
+
+    def peak_db(self):
+        """peak power of the whole capture in dB"""
+        return float(to_db(self.maxs[-1].max()))
+
+    def above(self, threshold_db, level=0):
+        """start time (ms) of the blocks with a peak above the threshold"""
+        time, _, peak, _ = self.get(level)
+        return time[peak > threshold_db]
+
+    def saturation_index(self, threshold=2262, level=0):
+        """fraction of the blocks with a peak magnitude above threshold"""
+        maxs = self.maxs[level]
+        return np.sum(maxs > threshold ** 2) / max(maxs.size, 1)
+
+    def save(self, path):
+        arrays = {}
+        for level in range(self.n_level):
+            arrays['min_{}'.format(level)] = self.mins[level]
+            arrays['max_{}'.format(level)] = self.maxs[level]
+            arrays['mean_{}'.format(level)] = self.means[level]
+        np.savez(str(path), block_samples=self.block_samples,
+                 factor=self.factor, fs_khz=self.fs_khz, **arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(str(path)) as npz:
+            n_level = sum(1 for name in npz.files if name.startswith('max_'))
+            return cls([npz['min_{}'.format(idx)] for idx in range(n_level)],
+                       [npz['max_{}'.format(idx)] for idx in range(n_level)],
+                       [npz['mean_{}'.format(idx)] for idx in range(n_level)],
+                       int(npz['block_samples']), int(npz['factor']),
+                       float(npz['fs_khz']))
+
+
+def to_db(power):
+    """power to dB, with the same floor of 0 dB as the plots"""
+    return 10 * np.log10(np.maximum(power, 1))
+
+
+def compute_envelope(source, fs_khz=None, block_samples=256, factor=4,
+                     chunk_blocks=4096):
+    """
+    compute the envelope in one pass
+
+    source: CaptureFile, streamed with iter_blocks, or a raw int16 I/Q
+        array (flat or (n, 2))
+    fs_khz: sampling rate, taken from the capture header by default,
+        required for an array
+    the samples after the last whole block are ignored
+    """
+    if fs_khz is None:
+        if isinstance(source, np.ndarray):
+            raise ValueError('fs_khz is required for array input')
+        fs_khz = float(source.header.fs_khz)
+
+    mins, maxs, means = [], [], []
+    for chunk in sfh.iter_chunks(source, block_samples * chunk_blocks):
+        n_block = len(chunk) // block_samples
+        if n_block == 0:
+            continue
+        power = np.square(chunk[:n_block * block_samples], dtype=np.float32)
+        power = power.sum(axis=1).reshape(n_block, block_samples)
+        mins.append(power.min(axis=1))
+        maxs.append(power.max(axis=1))
+        means.append(power.mean(axis=1))
+
+    mins = [np.concatenate(mins) if mins else np.zeros(0, np.float32)]
+    maxs = [np.concatenate(maxs) if maxs else np.zeros(0, np.float32)]
+    means = [np.concatenate(means) if means else np.zeros(0, np.float32)]
+    # merge the blocks level by level
+    while len(maxs[-1]) >= factor:
+        n_block = len(maxs[-1]) // factor
+        mins.append(mins[-1][:n_block * factor].reshape(-1, factor)
+                    .min(axis=1))
+        maxs.append(maxs[-1][:n_block * factor].reshape(-1, factor)
+                    .max(axis=1))
+        means.append(means[-1][:n_block * factor].reshape(-1, factor)
+                     .mean(axis=1))
+
+    return PowerEnvelope(mins, maxs, means, block_samples, factor, fs_khz)
+
+
+def sidecar_path(capture_path):
+    capture_path = Path(capture_path)
+    return capture_path.with_name(capture_path.name + SIDECAR_SUFFIX)
+
+
+def get_envelope(capture, recompute=False, save=True):
+    """
+    envelope of a capture, read from the sidecar if it is up to date
+
+    otherwise it is computed and, if `save`, written as the sidecar.
+    captures without a path are always computed.
+    """
+    path = getattr(capture, 'path', None)
+    if path is None:
+        return compute_envelope(capture)
+
+    sidecar = sidecar_path(path)
+    if (not recompute and sidecar.exists()
+            and sidecar.stat().st_mtime >= Path(path).stat().st_mtime):
+        return PowerEnvelope.load(sidecar)
+
+    envelope = compute_envelope(capture)
+    if save:
+        try:
+            envelope.save(sidecar)
+        except OSError:
+            # e.g. read-only archive
+            pass
+    return envelope
+
+
+def main():
+    parser = argparse.ArgumentParser(description='')
+    parser.add_argument('folder', type=str,
+                        help='folder of the captures')
+    parser.add_argument('--above', type=float,
+                        help='report captures with a peak above (dB)')
+    parser.add_argument('--overwrite', '-o', action='store_true',
+                        default=False, help='recompute existing sidecars')
+    args = parser.parse_args()
+
+    for path in Path(args.folder).rglob('*.dat'):
+        capture = sfh.CaptureFile(path=str(path), mmap=True)
+        envelope = get_envelope(capture, recompute=args.overwrite)
+        if args.above is None:
+            print('{}: peak {:.1f} dB'.format(path, envelope.peak_db()))
+            continue
+        bursts = envelope.above(args.above)
+        if bursts.size:
+            print('{}: {} blocks above {} dB, first at {:.3f} ms'.format(
+                path, bursts.size, args.above, bursts[0]))
+
+
+if __name__ == "__main__":
+    main()
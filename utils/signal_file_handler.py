@@ -1,8 +1,13 @@
+import io
+import os
 import pathlib
 import struct
 import numpy as np
 import scipy.io as spio
 
+# samples per chunk of the streaming statistics, see iter_chunks
+CHUNK_SAMPLES = 1 << 20
+
 
 class UsageException(Exception):
     """Raised when attempt is made to instantiate class incorrectly."""
@@ -22,6 +27,22 @@ class DataReadException(Exception):
     pass
 
 
+def decode_iq(data_int16, dtype=np.complex64):
+    """
+    Decode interleaved I/Q shorts into complex samples.
+
+    Arguments:
+        data_int16 [np.ndarray]: Interleaved I/Q samples (I0, Q0, I1, ...).
+        dtype [np.dtype]: Complex dtype of the decoded samples.
+    Returns:
+        [np.ndarray]: Complex samples, half the length of the input.
+    """
+    samples = np.empty(len(data_int16) // 2, dtype=dtype)
+    samples.real = data_int16[0::2]
+    samples.imag = data_int16[1::2]
+    return samples
+
+
 class SpectrogramHeader:
     # 'static' variables
     HEADER_FORMAT = "=BBBBIIIQQIIIIIIIIffIIBBBBBBBB"
@@ -73,8 +94,8 @@ class SpectrogramHeader:
         self.window_len = np.uint32(window_len)
         self.overlap_len = np.uint32(overlap_len)
         self.margin = np.uint32(margin)
-        self.tbin_width_ms = np.float(tbin_width_ms)
-        self.fbin_width_khz = np.float(fbin_width_khz)
+        self.tbin_width_ms = float(tbin_width_ms)
+        self.fbin_width_khz = float(fbin_width_khz)
         self.tbins = np.uint32(tbins)
         self.fbins = np.uint32(fbins)
         self.margin_removed = np.uint8(margin_removed)
@@ -102,12 +123,12 @@ class SpectrogramHeader:
 
 
 class SpectrogramFile:
-    def __init__(self, header=None, payload=None, path=None):
+    def __init__(self, header=None, payload=None, path=None, mmap=False):
         if header is not None and payload is not None:
             self.header = header
             self.payload = payload
         elif path is not None:
-            self.load(path)
+            self.load(path, mmap=mmap)
         else:
             raise UsageException
 
@@ -152,20 +173,26 @@ class SpectrogramFile:
                 self.header.reserved_5,
             )
             f.write(header_bytes)
-            # pack bytes in payload
-            data_bytes = struct.pack(
-                SpectrogramHeader.PAYLOAD_BYTEORDER
-                + str(self.header.tbins * self.header.fbins)
+            # write the float32 payload as it is in memory
+            data = np.asarray(
+                self.payload,
+                dtype=SpectrogramHeader.PAYLOAD_BYTEORDER
                 + SpectrogramHeader.PAYLOAD_FORMAT,
-                *self.payload,
             )
-            f.write(data_bytes)
+            if data.size != self.header.tbins * self.header.fbins:
+                raise UsageException
+            f.write(memoryview(np.ascontiguousarray(data).reshape(-1)))
 
         return dest_path
 
-    def load(self, path):
+    def load(self, path, mmap=False):
         """
         Load spectrogram file from disk.
+
+        Arguments:
+            path [str or pathlib.Path]: Path to the spectrogram file.
+            mmap [bool]: If True, the float32 payload is memory-mapped
+                read-only instead of being read into memory.
         """
         # read header and data
         with open(path, "rb") as f:
@@ -232,39 +259,84 @@ class SpectrogramFile:
             )
 
             # each value is a float (4 bytes)
-            data_len_bytes = self.header.tbins * self.header.fbins * 4
-            data = f.read(data_len_bytes)
-            if len(data) != data_len_bytes:
-                raise DataReadException
-
-            # parse data bytes
-            try:
-                self.payload = np.array(
-                    struct.unpack(
-                        SpectrogramHeader.PAYLOAD_BYTEORDER
-                        + str(self.header.tbins * self.header.fbins)
-                        + SpectrogramHeader.PAYLOAD_FORMAT,
-                        data,
-                    )
+            data_len_floats = int(self.header.tbins) * int(self.header.fbins)
+            payload_dtype = (
+                SpectrogramHeader.PAYLOAD_BYTEORDER
+                + SpectrogramHeader.PAYLOAD_FORMAT
+            )
+            if mmap:
+                file_len_bytes = os.fstat(f.fileno()).st_size
+                data_len_bytes = data_len_floats * 4
+                if (
+                    SpectrogramHeader.HEADER_LEN_BYTES + data_len_bytes
+                    > file_len_bytes
+                ):
+                    raise DataReadException
+            else:
+                self.payload = np.fromfile(
+                    f, dtype=payload_dtype, count=data_len_floats
                 )
-            except struct.error:
-                raise DataReadException
+                if self.payload.size != data_len_floats:
+                    raise DataReadException
+
+        if mmap:
+            self.payload = np.memmap(
+                path,
+                dtype=payload_dtype,
+                mode="r",
+                offset=SpectrogramHeader.HEADER_LEN_BYTES,
+                shape=(data_len_floats,),
+            )
 
     def get_spectrogram(self, keep_margin=False):
-        # reshape the spectrogram for plotting
-        spectrogram = (
-            np.array(self.payload)
-            .reshape(self.header.tbins, self.header.fbins)
-            .T
-        )
-        # roll the image such that the margin is shown at the top and bottom
-        spectrogram = np.roll(spectrogram, self.header.margin, axis=0)
+        tbins = int(self.header.tbins)
+        fbins = int(self.header.fbins)
+        margin = int(self.header.margin)
+        # reshape the spectrogram for plotting, this is a view of the payload
+        spectrogram = np.asarray(self.payload).reshape(tbins, fbins).T
+        # the margin is at the end of the frequency bins. Rolling the image
+        # by the margin would show it at the top and bottom, so the rows
+        # between the margins are the first fbins - 2 * margin rows.
         if not keep_margin:
-            spectrogram = spectrogram[
-                self.header.margin : self.header.fbins - self.header.margin, :
-            ]
+            return spectrogram[: fbins - 2 * margin, :]
 
-        return spectrogram
+        return np.concatenate(
+            (
+                spectrogram[fbins - margin :, :],
+                spectrogram[: fbins - margin, :],
+            )
+        )
+
+
+def load_spectrograms(paths, keep_margin=False):
+    """
+    Stack the spectrograms of many files into one array, e.g. as model input.
+
+    Arguments:
+        paths [iterable]: Paths to the spectrogram files, which should all
+            have the same shape.
+        keep_margin [bool]: Same as in SpectrogramFile.get_spectrogram.
+    Returns:
+        [np.ndarray]: Contiguous float32 array of shape (N, fbins, tbins).
+    """
+    paths = list(paths)
+    if not paths:
+        raise UsageException
+
+    spectrograms = None
+    for idx, path in enumerate(paths):
+        spectrogram = SpectrogramFile(path=path, mmap=True).get_spectrogram(
+            keep_margin
+        )
+        if spectrograms is None:
+            spectrograms = np.empty(
+                (len(paths),) + spectrogram.shape, dtype=np.float32
+            )
+        elif spectrogram.shape != spectrograms.shape[1:]:
+            raise DataReadException
+        spectrograms[idx] = spectrogram
+
+    return spectrograms
 
 
 class CaptureHeader:
@@ -293,6 +365,81 @@ class CaptureHeader:
     HEADER_V5_TRACK_LEN_BYTES = 228
     CAPTURE_MAX_DRONE_SEARCH_MAP_LEN = 10
 
+    # capture modes
+    CAPTURE_MODE_SEARCH = 0
+    CAPTURE_MODE_TRACK = 1
+
+    # precompiled header structs, the v5 track header is parsed as the
+    # search header followed by the drone search map
+    HEADER_V1_STRUCT = struct.Struct(HEADER_V1_FORMAT)
+    HEADER_V2_STRUCT = struct.Struct(HEADER_V2_FORMAT)
+    HEADER_V3_STRUCT = struct.Struct(HEADER_V3_FORMAT)
+    HEADER_V4_STRUCT = struct.Struct(HEADER_V4_FORMAT)
+    HEADER_V5_SEARCH_STRUCT = struct.Struct(HEADER_V5_FORMAT_SEARCH)
+    DRONE_SEARCH_MAP_STRUCT = struct.Struct(
+        ">I" + "III" * CAPTURE_MAX_DRONE_SEARCH_MAP_LEN
+    )
+    # names of the header fields, in file order. None is a field that is
+    # not kept in CaptureHeader.
+    HEADER_V1_FIELDS = (
+        "total_len",
+        "sensor_id",
+        "fc_khz",
+        "fs_khz",
+        "bw_khz",
+        "gain_db",
+        "start_time_ticks",
+        "tps",
+    )
+    HEADER_V2_FIELDS = HEADER_V1_FIELDS + (
+        "num_ant",
+        "ant_seq",
+        "ant_dwell_time_ms",
+        "capture_id",
+    )
+    HEADER_V3_FIELDS = HEADER_V2_FIELDS + (
+        "capture_mode",
+        "drone_search_bitmap",
+    )
+    HEADER_V4_FIELDS = (
+        "total_len",
+        "header_len",
+        None,  # header version
+        "sensor_id",
+        "fc_khz",
+        "fs_khz",
+        "bw_khz",
+        "gain_db",
+        "start_time_ticks",
+        "tps",
+        None,  # fpga_pps
+        None,  # fpga_start_time
+        None,  # fpga_tps
+        None,  # pps_flag
+        "num_ant",
+        "ant_seq",
+        "ant_dwell_time_ms",
+        "capture_id",
+        "capture_mode",
+        "drone_search_bitmap",
+    )
+    HEADER_V5_FIELDS = HEADER_V4_FIELDS[:-1] + ("ant_type", "angle")
+
+    # missing attributes of the older versions
+    # TODO: this is from old code, not sure we should keep it in the future
+    HEADER_V1_DEFAULTS = {
+        "num_ant": 1,
+        "ant_seq": 0,
+        "ant_dwell_time_ms": 633,
+        "capture_id": 0,
+        "capture_mode": CAPTURE_MODE_SEARCH,
+        "drone_search_bitmap": 0xFFFFFFFFFFFFFF,
+    }
+    HEADER_V2_DEFAULTS = {
+        "capture_mode": CAPTURE_MODE_SEARCH,
+        "drone_search_bitmap": 0xFFFFFFFFFFFFFF,
+    }
+
     PAYLOAD_BYTEORDER = "<"
     PAYLOAD_FORMAT = "h"
 
@@ -306,10 +453,6 @@ class CaptureHeader:
     PAYLOAD_V3_LEN_3 = 47264000  # 211 ms
     # NOTE: v4/v5 does not have a specified payload length
 
-    # capture modes
-    CAPTURE_MODE_SEARCH = 0
-    CAPTURE_MODE_TRACK = 1
-
     def __init__(
         self,
         version,
@@ -378,12 +521,12 @@ class CaptureHeader:
         else:
             if self.capture_mode == CaptureHeader.CAPTURE_MODE_SEARCH:
                 if header_len is None:
-                    self.header_len = CaptureHeader.HEADER_V5_FORMAT_SEARCH
+                    self.header_len = CaptureHeader.HEADER_V5_SEARCH_LEN_BYTES
                 else:
                     self.header_len = header_len
             else:
                 if header_len is None:
-                    self.header_len = CaptureHeader.HEADER_V5_FORMAT_TRACK
+                    self.header_len = CaptureHeader.HEADER_V5_TRACK_LEN_BYTES
                 else:
                     self.header_len = header_len
 
@@ -395,6 +538,32 @@ class CaptureHeader:
         num_iq_pair_in_payload = num_int_in_payload // 2
         self.dwell_time_ms = num_iq_pair_in_payload / self.fs_khz
 
+    def antenna_sequence(self):
+        """
+        Utility function to get the antenna of each dwell.
+
+        Arguments:
+            None
+        Returns:
+            [list]: Antenna index of each dwell in capture order, one nibble
+                of ant_seq per dwell starting from the lowest one.
+        """
+        return [
+            (int(self.ant_seq) >> (4 * idx)) & 0xF
+            for idx in range(int(self.num_ant))
+        ]
+
+    def antenna_dwell_samples(self):
+        """
+        Utility function to get the number of samples in one antenna dwell.
+
+        Arguments:
+            None
+        Returns:
+            [int]: ant_dwell_time_ms in samples.
+        """
+        return int(self.ant_dwell_time_ms) * int(self.fs_khz)
+
     def get(self):
         """
         Utility function to get the header information as a dict.
@@ -410,353 +579,288 @@ class CaptureHeader:
         return "CaptureHeader: {}".format(vars(self))
 
 
+# dtype of the bulk header table, see read_capture_headers
+CAPTURE_HEADER_DTYPE = np.dtype(
+    [
+        ("header_version", np.uint32),
+        ("header_len", np.uint32),
+        ("total_len", np.uint32),
+        ("sensor_id", np.uint32),
+        ("fc_khz", np.uint32),
+        ("fs_khz", np.uint32),
+        ("bw_khz", np.uint32),
+        ("gain_db", np.uint32),
+        ("start_time_ticks", np.uint64),
+        ("tps", np.uint64),
+        ("num_ant", np.uint32),
+        ("ant_seq", np.uint64),
+        ("ant_dwell_time_ms", np.uint32),
+        ("capture_id", np.uint32),
+        ("capture_mode", np.uint32),
+    ]
+)
+
+
+def _capture_header_layout(header):
+    """
+    Find the header version and length from the first bytes of a capture.
+
+    This section is intended to match engined/utils/common.h
+    """
+    # the first element is always an integer written as big-endian
+    try:
+        (total_len,) = struct.unpack_from(">I", header)
+    except struct.error:
+        # this can happen in 'copy_dat_files', when a file with
+        # extension .dat that is actually not a capture file is input
+        raise DataReadException
+
+    # addition of 4 is because 'total_len' does not include its own length
+    if total_len + 4 in (
+        CaptureHeader.PAYLOAD_V1_LEN_1 + CaptureHeader.HEADER_V1_LEN_BYTES,
+        CaptureHeader.PAYLOAD_V1_LEN_2 + CaptureHeader.HEADER_V1_LEN_BYTES,
+    ):
+        return 1, CaptureHeader.HEADER_V1_LEN_BYTES
+    if total_len + 4 == (
+        CaptureHeader.PAYLOAD_V2_LEN + CaptureHeader.HEADER_V2_LEN_BYTES
+    ):
+        return 2, CaptureHeader.HEADER_V2_LEN_BYTES
+    if total_len + 4 in (
+        CaptureHeader.PAYLOAD_V3_LEN_1 + CaptureHeader.HEADER_V3_LEN_BYTES,
+        CaptureHeader.PAYLOAD_V3_LEN_2 + CaptureHeader.HEADER_V3_LEN_BYTES,
+        CaptureHeader.PAYLOAD_V3_LEN_3 + CaptureHeader.HEADER_V3_LEN_BYTES,
+    ):
+        return 3, CaptureHeader.HEADER_V3_LEN_BYTES
+
+    # for version number > 3
+    try:
+        header_len_bytes, header_version = struct.unpack_from(
+            ">II", header, 4
+        )
+    except struct.error:
+        raise DataReadException
+    return header_version, header_len_bytes
+
+
+def _unpack_capture_header(header):
+    """
+    Parse the header fields from the first bytes of a capture.
+
+    Arguments:
+        header [bytes]: At least the header bytes of the capture.
+    Returns:
+        [tuple]: header version, header length in bytes and a dict of the
+            header fields, named as the CaptureHeader arguments.
+    """
+    header_version, header_len_bytes = _capture_header_layout(header)
+    if header_version == 1:
+        header_struct = CaptureHeader.HEADER_V1_STRUCT
+        names = CaptureHeader.HEADER_V1_FIELDS
+    elif header_version == 2:
+        header_struct = CaptureHeader.HEADER_V2_STRUCT
+        names = CaptureHeader.HEADER_V2_FIELDS
+    elif header_version == 3:
+        header_struct = CaptureHeader.HEADER_V3_STRUCT
+        names = CaptureHeader.HEADER_V3_FIELDS
+    elif header_version == 4:
+        header_struct = CaptureHeader.HEADER_V4_STRUCT
+        names = CaptureHeader.HEADER_V4_FIELDS
+    elif header_version == 5:
+        header_struct = CaptureHeader.HEADER_V5_SEARCH_STRUCT
+        names = CaptureHeader.HEADER_V5_FIELDS
+    else:
+        raise DataReadException
+
+    if len(header) < max(header_len_bytes, header_struct.size):
+        # raise exception if read bytes are less than expected
+        raise HeaderReadException
+    fields = {
+        name: value
+        for name, value in zip(names, header_struct.unpack_from(header))
+        if name is not None
+    }
+
+    if (
+        header_version == 5
+        and fields["capture_mode"] == CaptureHeader.CAPTURE_MODE_TRACK
+    ):
+        # track mode has an extra drone search map structure
+        try:
+            search_map = CaptureHeader.DRONE_SEARCH_MAP_STRUCT.unpack_from(
+                header, header_struct.size
+            )
+        except struct.error:
+            raise HeaderReadException
+        fields["drone_search_map_len"] = search_map[0]
+        # the second value of each entry is skipped, this is the current
+        # implementation in engined, and it probably will change
+        fields["drone_search_map"] = [
+            {"dr_type": dr_type, "chan_num": 1, "chan_list": [chan]}
+            for dr_type, _, chan in zip(
+                search_map[1::3], search_map[2::3], search_map[3::3]
+            )
+        ]
+
+    return header_version, header_len_bytes, fields
+
+
+def _read_capture_header(f):
+    """
+    Read the capture header at the start of an open capture file.
+
+    Returns:
+        [tuple]: CaptureHeader and the header length in bytes.
+    """
+    f.seek(0)
+    header_version, header_len_bytes = _capture_header_layout(f.read(12))
+    f.seek(0)
+    header = f.read(max(header_len_bytes, CaptureHeader.HEADER_V1_LEN_BYTES))
+    header_version, header_len_bytes, fields = _unpack_capture_header(header)
+
+    capture_header = CaptureHeader(header_version, **fields)
+    if header_version == 1:
+        defaults = CaptureHeader.HEADER_V1_DEFAULTS
+    elif header_version == 2:
+        defaults = CaptureHeader.HEADER_V2_DEFAULTS
+    else:
+        defaults = {}
+    for name, value in defaults.items():
+        setattr(capture_header, name, value)
+
+    return capture_header, header_len_bytes
+
+
+def read_capture_header(path):
+    """
+    Read only the header of a capture file.
+
+    Arguments:
+        path [str or pathlib.Path]: Path to the capture file.
+    Returns:
+        [CaptureHeader]: Header of the capture.
+    """
+    with open(str(path), "rb") as f:
+        header, _ = _read_capture_header(f)
+    return header
+
+
+def parse_capture_header(header_bytes):
+    """
+    Parse a packed capture header, e.g. from CaptureFile.header_bytes.
+
+    Arguments:
+        header_bytes [bytes]: The header at the start of a capture file.
+    Returns:
+        [CaptureHeader]: Header as `load` would read it from the file.
+    """
+    header, _ = _read_capture_header(io.BytesIO(header_bytes))
+    return header
+
+
+def iter_chunks(source, chunk_samples=None):
+    """
+    Iterate over a capture file or an array of samples in chunks.
+
+    Arguments:
+        source: CaptureFile (its raw int16 data is read with `iter_blocks`),
+            int16 I/Q (flat or (n, 2)) or an array of samples, e.g. complex.
+        chunk_samples [int]: Number of samples in each chunk,
+            CHUNK_SAMPLES by default.
+    Yields:
+        [np.ndarray]: (n, 2) int16 blocks for a capture or int16 input,
+            slices of the array along its first axis otherwise.
+    """
+    if chunk_samples is None:
+        chunk_samples = CHUNK_SAMPLES
+    if hasattr(source, "iter_blocks"):
+        return source.iter_blocks(chunk_samples, dtype=np.int16)
+    x = np.asarray(source)
+    if x.dtype == np.int16:
+        x = x.reshape(-1, 2)
+    return (
+        x[idx : idx + chunk_samples] for idx in range(0, len(x), chunk_samples)
+    )
+
+
+def read_capture_headers(paths, skip_invalid=False):
+    """
+    Read the headers of many capture files into one structured array.
+
+    Arguments:
+        paths [iterable]: Paths to the capture files.
+        skip_invalid [bool]: If True, files that are not valid captures get
+            a row of zeros instead of raising an exception.
+    Returns:
+        [np.ndarray]: One row of CAPTURE_HEADER_DTYPE per path.
+    """
+    names = CAPTURE_HEADER_DTYPE.names
+    rows = []
+    for path in paths:
+        try:
+            with open(str(path), "rb") as f:
+                header = f.read(CaptureHeader.HEADER_V5_TRACK_LEN_BYTES)
+            header_version, header_len_bytes, fields = _unpack_capture_header(
+                header
+            )
+        except (OSError, DataReadException, HeaderReadException):
+            if not skip_invalid:
+                raise
+            rows.append((0,) * len(names))
+            continue
+
+        if header_version == 1:
+            fields.update(CaptureHeader.HEADER_V1_DEFAULTS)
+        elif header_version == 2:
+            fields.update(CaptureHeader.HEADER_V2_DEFAULTS)
+        fields["header_version"] = header_version
+        fields["header_len"] = header_len_bytes
+        rows.append(tuple(fields[name] for name in names))
+
+    return np.array(rows, dtype=CAPTURE_HEADER_DTYPE)
+
+
 class CaptureFile:
     """Class representation of capture data."""
 
-    def __init__(self, *args, header=None, data=None, path=None):
+    # number of shorts written at once by save
+    SAVE_CHUNK_SHORTS = 1 << 22
+
+    def __init__(self, *args, header=None, data=None, path=None, mmap=False):
         args = [str(a) for a in args]
+        self._data = None
+        self._payload = None
+        self.path = None
         if header is not None and data is not None:
             self.header = header
             self._data = data
-            self.payload = None
         elif path is not None:
-            self.load(path)
+            self.load(path, mmap=mmap)
         elif (len(args) == 1) and (".dat" in args[0]):
             # if the provided input is the path of capture file
-            self.load(args[0])
+            self.load(args[0], mmap=mmap)
         else:
             raise UsageException
 
-    def load(self, path):
+    def load(self, path, mmap=False):
         """
         Load capture data.
 
         Arguments:
             path [str or pathlib.Path]: Path to the capture file.
+            mmap [bool]: If True, the int16 payload is memory-mapped
+                read-only instead of being read into memory.
         """
         # convert to str, in case the input is pathlib.Path
         path = str(path)
+        self.path = pathlib.Path(path)
 
         if pathlib.Path(path).suffix == ".mat":
             self._load_mat(path)
             return
 
         with open(path, "rb") as f:
-            # the first element is always an integer written as big-endian
-            try:
-                total_len = struct.unpack(">I", f.read(4))[0]
-            except struct.error:
-                # this can happen in 'copy_dat_files', when a file with
-                # extension .dat that is actually not a capture file is input
-                raise DataReadException
+            self.header, header_len_bytes = _read_capture_header(f)
 
-            # this section is intended to match engined/utils/common.h
-            # addition of 4 is because 'total_len' does not include its own
-            # length
-            if total_len + 4 in (
-                (
-                    CaptureHeader.PAYLOAD_V1_LEN_1
-                    + CaptureHeader.HEADER_V1_LEN_BYTES
-                ),
-                (
-                    CaptureHeader.PAYLOAD_V1_LEN_2
-                    + CaptureHeader.HEADER_V1_LEN_BYTES
-                ),
-            ):
-                header_version = 1
-                header_len_bytes = CaptureHeader.HEADER_V1_LEN_BYTES
-            elif total_len + 4 == (
-                CaptureHeader.PAYLOAD_V2_LEN
-                + CaptureHeader.HEADER_V2_LEN_BYTES
-            ):
-                header_version = 2
-                header_len_bytes = CaptureHeader.HEADER_V2_LEN_BYTES
-            elif total_len + 4 in (
-                (
-                    CaptureHeader.PAYLOAD_V3_LEN_1
-                    + CaptureHeader.HEADER_V3_LEN_BYTES
-                ),
-                (
-                    CaptureHeader.PAYLOAD_V3_LEN_2
-                    + CaptureHeader.HEADER_V3_LEN_BYTES
-                ),
-                (
-                    CaptureHeader.PAYLOAD_V3_LEN_3
-                    + CaptureHeader.HEADER_V3_LEN_BYTES
-                ),
-            ):
-                header_version = 3
-                header_len_bytes = CaptureHeader.HEADER_V3_LEN_BYTES
-            else:
-                # for version number > 3
-                try:
-                    header_len_bytes = struct.unpack(">I", f.read(4))[0]
-                    header_version = struct.unpack(">I", f.read(4))[0]
-                except struct.error:
-                    # this can happen in 'copy_dat_files', when a file with
-                    # extension .dat that is actually not a capture file is
-                    # input
-                    raise DataReadException
-
-            # rewind
-            f.seek(0)
-            if header_version == 1:
-                header = f.read(header_len_bytes)
-                if len(header) != header_len_bytes:
-                    # raise exception if read bytes are less than expected
-                    raise HeaderReadException
-
-                # parse header bytes
-                (
-                    total_len,
-                    sensor_id,
-                    fc_khz,
-                    fs_khz,
-                    bw_khz,
-                    gain_db,
-                    start_time_ticks,
-                    tps,
-                ) = struct.unpack(CaptureHeader.HEADER_V1_FORMAT, header)
-                # create header object
-                self.header = CaptureHeader(
-                    header_version,
-                    total_len,
-                    sensor_id,
-                    fc_khz,
-                    fs_khz,
-                    bw_khz,
-                    gain_db,
-                    start_time_ticks,
-                    tps,
-                )
-
-                # Fill the missing attributes.
-                # TODO: this is from old code, not sure we should keep it in
-                #  the future
-                self.header.num_ant = 1
-                self.header.ant_seq = 0
-                self.header.ant_dwell_time_ms = 633
-                self.header.capture_id = 0
-                self.header.capture_mode = CaptureHeader.CAPTURE_MODE_SEARCH
-                self.header.drone_search_bitmap = 0xFFFFFFFFFFFFFF
-            elif header_version == 2:
-                header = f.read(header_len_bytes)
-                if len(header) != header_len_bytes:
-                    # raise exception if read bytes are less than expected
-                    raise HeaderReadException
-
-                # parse header bytes
-                (
-                    total_len,
-                    sensor_id,
-                    fc_khz,
-                    fs_khz,
-                    bw_khz,
-                    gain_db,
-                    start_time_ticks,
-                    tps,
-                    num_ant,
-                    ant_seq,
-                    ant_dwell_time_ms,
-                    capture_id,
-                ) = struct.unpack(CaptureHeader.HEADER_V2_FORMAT, header)
-                # create header object
-                self.header = CaptureHeader(
-                    header_version,
-                    total_len,
-                    sensor_id,
-                    fc_khz,
-                    fs_khz,
-                    bw_khz,
-                    gain_db,
-                    start_time_ticks,
-                    tps,
-                    num_ant,
-                    ant_seq,
-                    ant_dwell_time_ms,
-                    capture_id,
-                )
-
-                # Fill the missing information.
-                # TODO: this is from old code, not sure we should keep it in
-                #  the future
-                self.header.capture_mode = CaptureHeader.CAPTURE_MODE_SEARCH
-                self.header.drone_search_bitmap = 0xFFFFFFFFFFFFFF
-            elif header_version == 3:
-                header = f.read(header_len_bytes)
-                if len(header) != header_len_bytes:
-                    # raise exception if read bytes are less than expected
-                    raise HeaderReadException
-
-                # parse header bytes
-                (
-                    total_len,
-                    sensor_id,
-                    fc_khz,
-                    fs_khz,
-                    bw_khz,
-                    gain_db,
-                    start_time_ticks,
-                    tps,
-                    num_ant,
-                    ant_seq,
-                    ant_dwell_time_ms,
-                    capture_id,
-                    capture_mode,
-                    drone_search_bitmap,
-                ) = struct.unpack(CaptureHeader.HEADER_V3_FORMAT, header)
-                # create header object
-                self.header = CaptureHeader(
-                    header_version,
-                    total_len,
-                    sensor_id,
-                    fc_khz,
-                    fs_khz,
-                    bw_khz,
-                    gain_db,
-                    start_time_ticks,
-                    tps,
-                    num_ant,
-                    ant_seq,
-                    ant_dwell_time_ms,
-                    capture_id,
-                    capture_mode,
-                    drone_search_bitmap,
-                )
-            elif header_version == 4:
-                header = f.read(header_len_bytes)
-                if len(header) != header_len_bytes:
-                    # raise exception if read bytes are less than expected
-                    raise HeaderReadException
-
-                # parse header bytes
-                (
-                    total_len,
-                    header_len,
-                    _,
-                    sensor_id,
-                    fc_khz,
-                    fs_khz,
-                    bw_khz,
-                    gain_db,
-                    start_time_ticks,
-                    tps,
-                    fpga_pps,
-                    fpga_start_time,
-                    fpga_tps,
-                    pps_flag,
-                    num_ant,
-                    ant_seq,
-                    ant_dwell_time_ms,
-                    capture_id,
-                    capture_mode,
-                    drone_search_bitmap,
-                ) = struct.unpack(CaptureHeader.HEADER_V4_FORMAT, header)
-                # create header object
-                self.header = CaptureHeader(
-                    header_version,
-                    total_len,
-                    sensor_id,
-                    fc_khz,
-                    fs_khz,
-                    bw_khz,
-                    gain_db,
-                    start_time_ticks,
-                    tps,
-                    num_ant,
-                    ant_seq,
-                    ant_dwell_time_ms,
-                    capture_id,
-                    capture_mode,
-                    drone_search_bitmap=drone_search_bitmap,
-                    header_len=header_len,
-                )
-            elif header_version == 5:
-                header = f.read(header_len_bytes)
-                if len(header) != header_len_bytes:
-                    # raise exception if read bytes are less than expected
-                    raise HeaderReadException
-
-                if header_len_bytes > CaptureHeader.HEADER_V5_SEARCH_LEN_BYTES:
-                    # this is track mode
-                    f.seek(0)
-                    header = f.read(CaptureHeader.HEADER_V5_SEARCH_LEN_BYTES)
-
-                # parse header bytes for search mode
-                (
-                    total_len,
-                    header_len,
-                    _,
-                    sensor_id,
-                    fc_khz,
-                    fs_khz,
-                    bw_khz,
-                    gain_db,
-                    start_time_ticks,
-                    tps,
-                    fpga_pps,
-                    fpga_start_time,
-                    fpga_tps,
-                    pps_flag,
-                    num_ant,
-                    ant_seq,
-                    ant_dwell_time_ms,
-                    capture_id,
-                    capture_mode,
-                    ant_type,
-                    angle,
-                ) = struct.unpack(
-                    CaptureHeader.HEADER_V5_FORMAT_SEARCH, header
-                )
-                if capture_mode == CaptureHeader.CAPTURE_MODE_TRACK:
-                    # track mode has an extra drone search map structure
-                    drone_search_map = []
-                    drone_search_map_len = struct.unpack(">I", f.read(4))[0]
-
-                    # Loop to get the drone_search_map
-                    for _ in range(
-                        CaptureHeader.CAPTURE_MAX_DRONE_SEARCH_MAP_LEN
-                    ):
-                        dr_type = struct.unpack(">I", f.read(4))[0]
-                        # this is the current implementation
-                        # in engined, and it probably will change
-                        _ = struct.unpack(">I", f.read(4))[0]
-                        chan_num = 1
-                        chan_list = [struct.unpack(">I", f.read(4))[0]]
-                        search_map = {
-                            "dr_type": dr_type,
-                            "chan_num": chan_num,
-                            "chan_list": chan_list,
-                        }
-                        drone_search_map.append(search_map)
-                else:
-                    drone_search_map_len = None
-                    drone_search_map = None
-
-                # create header object
-                self.header = CaptureHeader(
-                    header_version,
-                    total_len,
-                    sensor_id,
-                    fc_khz,
-                    fs_khz,
-                    bw_khz,
-                    gain_db,
-                    start_time_ticks,
-                    tps,
-                    num_ant,
-                    ant_seq,
-                    ant_dwell_time_ms,
-                    capture_id,
-                    capture_mode,
-                    ant_type=ant_type,
-                    angle=angle,
-                    drone_search_map_len=drone_search_map_len,
-                    drone_search_map=drone_search_map,
-                    header_len=header_len,
-                )
-            else:
-                raise DataReadException
             # Need to subtract 4 because the value of the total_len field does
             # not include its own size. the last 4 bytes in the file are
             # ignored.
@@ -764,27 +868,131 @@ class CaptureFile:
             if data_len_bytes < 1:
                 raise DataReadException
 
-            data = f.read(data_len_bytes)
-            if len(data) != data_len_bytes:
-                raise DataReadException
-
             # Each sample is a 2-byte short
             data_len_shorts = data_len_bytes // 2
-            try:
-                data_int16 = np.array(
-                    struct.unpack(
-                        self.header.PAYLOAD_BYTEORDER
-                        + str(data_len_shorts)
-                        + self.header.PAYLOAD_FORMAT,
-                        data,
-                    )
+            f.seek(header_len_bytes)
+            if mmap:
+                # the payload starts right after the version specific header
+                file_len_bytes = os.fstat(f.fileno()).st_size
+                if header_len_bytes + data_len_bytes > file_len_bytes:
+                    raise DataReadException
+            else:
+                data_int16 = np.fromfile(
+                    f,
+                    dtype=self.header.PAYLOAD_BYTEORDER
+                    + self.header.PAYLOAD_FORMAT,
+                    count=data_len_shorts,
                 )
-            except struct.error:
-                raise DataReadException
+                if data_int16.size != data_len_shorts:
+                    raise DataReadException
+
+        if mmap:
+            data_int16 = np.memmap(
+                path,
+                dtype=self.header.PAYLOAD_BYTEORDER
+                + self.header.PAYLOAD_FORMAT,
+                mode="r",
+                offset=header_len_bytes,
+                shape=(data_len_shorts,),
+            )
+
+        # Save the raw binary data, the complex payload is decoded on demand
+        self._data = data_int16
+        self._payload = None
+
+    @property
+    def payload(self):
+        """
+        Complex128 samples of the whole capture, decoded on first access.
+
+        Use `samples` to decode only a time range or to get a smaller dtype.
+        """
+        if self._payload is None and self._data is not None:
+            self._payload = decode_iq(self._data, np.complex128)
+        return self._payload
+
+    @payload.setter
+    def payload(self, value):
+        self._payload = value
+
+    @property
+    def num_samples(self):
+        """Number of complex samples in the capture."""
+        if self._data is not None:
+            return len(self._data) // 2
+        return len(self._payload)
+
+    def samples(self, t0_ms=0, t1_ms=None, dtype=np.complex128):
+        """
+        Get the samples in a time range of the capture.
+
+        Arguments:
+            t0_ms [float]: Start of the range, relative to the capture start.
+            t1_ms [float]: End of the range, end of the capture by default.
+            dtype [np.dtype]: np.complex128 or np.complex64 to decode the
+                samples, np.int16 to get a (n, 2) I/Q view of the raw data.
+        Returns:
+            [np.ndarray]: Samples in the requested range.
+        """
+        # fs_khz is the number of samples per millisecond
+        start = int(round(t0_ms * float(self.header.fs_khz)))
+        if t1_ms is None:
+            stop = self.num_samples
+        else:
+            stop = int(round(t1_ms * float(self.header.fs_khz)))
+        start = min(max(start, 0), self.num_samples)
+        stop = min(max(stop, start), self.num_samples)
+
+        if self._data is None:
+            # no raw data, e.g. loaded from a .mat file
+            if np.dtype(dtype) == np.int16:
+                raise UsageException
+            return self._payload[start:stop].astype(dtype, copy=False)
+
+        raw = self._data[2 * start : 2 * stop]
+        if np.dtype(dtype) == np.int16:
+            return raw.reshape(-1, 2)
+        if self._payload is not None and self._payload.dtype == dtype:
+            return self._payload[start:stop]
+        return decode_iq(raw, dtype)
+
+    def iter_blocks(self, block_samples, overlap=0, dtype=np.complex64):
+        """
+        Iterate over the capture in blocks of samples.
+
+        Only one block is decoded at a time, so with a memory-mapped capture
+        (mmap=True) the memory use does not depend on the capture length.
 
-            # Save the raw binary data
-            self._data = data_int16
-            self.payload = data_int16[0::2] + 1j * data_int16[1::2]
+        Arguments:
+            block_samples [int]: Number of samples in each block. The last
+                block is shorter if the capture is not a multiple of the
+                block step.
+            overlap [int]: Number of samples shared by consecutive blocks.
+            dtype [np.dtype]: Same as in `samples`.
+        Yields:
+            [np.ndarray]: Blocks of samples.
+        """
+        block_samples = int(block_samples)
+        overlap = int(overlap)
+        if block_samples < 1 or not 0 <= overlap < block_samples:
+            raise ValueError("overlap should be smaller than block_samples")
+
+        num_samples = self.num_samples
+        step = block_samples - overlap
+        start = 0
+        while start < num_samples:
+            stop = min(start + block_samples, num_samples)
+            if self._data is None:
+                if np.dtype(dtype) == np.int16:
+                    raise UsageException
+                yield self._payload[start:stop].astype(dtype, copy=False)
+            elif np.dtype(dtype) == np.int16:
+                yield self._data[2 * start : 2 * stop].reshape(-1, 2)
+            else:
+                yield decode_iq(self._data[2 * start : 2 * stop], dtype)
+            if stop == num_samples:
+                break
+            start += step
 
     def _load_mat(self, path):
         data = spio.loadmat(path, squeeze_me=True)
@@ -801,19 +1009,29 @@ class CaptureFile:
             0,
             0,
         )
+        self._data = None
         self.payload = data["rxdata"]
 
-    def save(
+    def header_bytes(
         self,
-        dest_path,
+        data_length,
         version=None,
-        capture_len=None,
         center_freq=None,
         capture_mode=None,
         capture_sid=None,
         capture_bw=None,
     ):
+        """
+        Pack the file header of a capture, as written by `save`.
 
+        Arguments:
+            data_length [int]: Number of shorts in the payload.
+            version [int]: Header version, v5 for v1 to v3 captures and the
+                capture version otherwise by default.
+            Other arguments are the same as in `save`.
+        Returns:
+            [bytes]: Header bytes, the payload follows them in the file.
+        """
         # common attributes
         if capture_sid is not None:
             sensor_id = np.uint32(capture_sid)
@@ -878,15 +1096,8 @@ class CaptureFile:
                 ant_type = np.uint32(0)
                 angle = np.uint32(0)
 
-        # determine the data length
-        if capture_len is not None:
-            # number of short int
-            data_length = self.header.fs_khz * capture_len * 2
-        else:
-            data_length = len(self._data)
-
         # determine which version to save
-        version_to_save = None
+        version_to_save = version
         if version is None:
             if self.header.header_version < 4:
                 # the capture is saved using version 5
@@ -894,7 +1105,62 @@ class CaptureFile:
             else:
                 version_to_save = self.header.header_version
 
-        if version_to_save == 4:
+        if version_to_save in (1, 2, 3):
+            # the old versions are recognised by their payload length, only
+            # a few capture lengths can be saved
+            header_len, header_format, names, payload_lens = {
+                1: (
+                    CaptureHeader.HEADER_V1_LEN_BYTES,
+                    CaptureHeader.HEADER_V1_FORMAT,
+                    CaptureHeader.HEADER_V1_FIELDS,
+                    (
+                        CaptureHeader.PAYLOAD_V1_LEN_1,
+                        CaptureHeader.PAYLOAD_V1_LEN_2,
+                    ),
+                ),
+                2: (
+                    CaptureHeader.HEADER_V2_LEN_BYTES,
+                    CaptureHeader.HEADER_V2_FORMAT,
+                    CaptureHeader.HEADER_V2_FIELDS,
+                    (CaptureHeader.PAYLOAD_V2_LEN,),
+                ),
+                3: (
+                    CaptureHeader.HEADER_V3_LEN_BYTES,
+                    CaptureHeader.HEADER_V3_FORMAT,
+                    CaptureHeader.HEADER_V3_FIELDS,
+                    (
+                        CaptureHeader.PAYLOAD_V3_LEN_1,
+                        CaptureHeader.PAYLOAD_V3_LEN_2,
+                        CaptureHeader.PAYLOAD_V3_LEN_3,
+                    ),
+                ),
+            }[version_to_save]
+            if 2 * data_length not in payload_lens:
+                raise ValueError(
+                    "v{} captures have a payload of {} bytes".format(
+                        version_to_save, payload_lens
+                    )
+                )
+            total_length = header_len + 2 * data_length - 4  # total_length
+            # is not included
+            values = {
+                "total_len": total_length,
+                "sensor_id": sensor_id,
+                "fc_khz": fc_khz,
+                "fs_khz": fs_khz,
+                "bw_khz": bw_khz,
+                "gain_db": gain_db,
+                "start_time_ticks": start_time_ticks,
+                "tps": tps,
+                "num_ant": num_ant,
+                "ant_seq": ant_seq,
+                "ant_dwell_time_ms": ant_dwell_time_ms,
+                "capture_id": capture_id,
+                "capture_mode": capture_mode,
+                "drone_search_bitmap": drone_search_bitmap,
+            }
+            header = [header_format] + [values[name] for name in names]
+        elif version_to_save == 4:
             header_len = CaptureHeader.HEADER_V4_LEN_BYTES
             total_length = header_len + 2 * data_length - 4  # total_length
             # is not included
@@ -972,33 +1238,58 @@ class CaptureFile:
                 else:
                     header += 31 * [np.uint32(0)]
         else:
-            raise ValueError("Only support return v4/v5 format capture")
+            raise ValueError("Only support return v1 to v5 format capture")
+
+        return struct.pack(*header)
+
+    def save(
+        self,
+        dest_path,
+        version=None,
+        capture_len=None,
+        center_freq=None,
+        capture_mode=None,
+        capture_sid=None,
+        capture_bw=None,
+    ):
+
+        # determine the data length
+        if capture_len is not None:
+            # number of short int
+            data_length = int(self.header.fs_khz * capture_len * 2)
+        else:
+            data_length = len(self._data)
+
+        header_bytes = self.header_bytes(
+            data_length,
+            version=version,
+            center_freq=center_freq,
+            capture_mode=capture_mode,
+            capture_sid=capture_sid,
+            capture_bw=capture_bw,
+        )
 
         with open(dest_path, "wb") as f:
-            # pack bytes in header
-            header_bytes = struct.pack(*header)
             f.write(header_bytes)
 
-            # pack bytes in payload
-            if data_length <= len(self._data):
-                data_bytes = struct.pack(
-                    CaptureHeader.PAYLOAD_BYTEORDER
-                    + str(len(self._data[:data_length]))
-                    + CaptureHeader.PAYLOAD_FORMAT,
-                    *self._data[:data_length],
-                )
-            else:
-                # pad one for longer than previous data length
-                data_bytes = struct.pack(
-                    CaptureHeader.PAYLOAD_BYTEORDER
-                    + str(data_length)
-                    + CaptureHeader.PAYLOAD_FORMAT,
-                    *np.concatenate(
-                        [
-                            self._data,
-                            np.ones(data_length - len(self._data)).astype(int),
-                        ]
-                    ),
+            # write the payload from the little-endian int16 buffer, chunk
+            # by chunk so that memory-mapped data is never fully loaded
+            payload_dtype = (
+                CaptureHeader.PAYLOAD_BYTEORDER + CaptureHeader.PAYLOAD_FORMAT
+            )
+            copy_length = min(data_length, len(self._data))
+            for start in range(0, copy_length, CaptureFile.SAVE_CHUNK_SHORTS):
+                stop = min(start + CaptureFile.SAVE_CHUNK_SHORTS, copy_length)
+                chunk = np.asarray(self._data[start:stop])
+                f.write(memoryview(chunk.astype(payload_dtype, copy=False)))
+
+            # pad one for longer than previous data length
+            pad_length = data_length - copy_length
+            if pad_length > 0:
+                pad = np.ones(
+                    min(pad_length, CaptureFile.SAVE_CHUNK_SHORTS),
+                    dtype=payload_dtype,
                 )
-
-            f.write(data_bytes)
+                for start in range(0, pad_length, len(pad)):
+                    stop = min(start + len(pad), pad_length)
+                    f.write(memoryview(pad[: stop - start]))
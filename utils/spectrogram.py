@@ -0,0 +1,146 @@
+"""
+spectrogram engine shared by the visualization and labeling tools
+
+the input can be complex samples or the raw interleaved int16 I/Q of a
+capture, frames are converted to complex64 batch by batch and transformed
+with a multi-threaded FFT, the output is float32.
+"""
+
+import numpy as np
+from scipy import fft
+from scipy import signal
+
+
+def spectrogram(x, nfft=512, hop=None, window=None, decimate=1, average=1,
+                fs=1.0, mode='psd', log=True, floor=None, fftshift=True,
+                workers=-1, batch_frames=1024):
+    """
+    compute the spectrogram of a signal
+
+    x: complex samples, or int16 I/Q interleaved (flat or shape (n, 2))
+    nfft: number of samples in each frame, also the FFT size
+    hop: number of samples between frames, nfft (no overlap) by default
+    window: name or array for scipy.signal.get_window, rectangular if None
+    decimate: keep one frame out of `decimate` frames
+    average: number of consecutive frames averaged into one column, the
+        frames that do not fill a last column are dropped
+    fs: sampling rate, the psd is scaled like matplotlib specgram
+    mode: 'psd' for the power spectral density, 'magnitude' for |X|
+    log: convert to dB in place
+    floor: values are clipped to floor before the log conversion
+    fftshift: put the negative frequencies first (twosided layout)
+    workers: number of FFT threads, all cores by default
+    batch_frames: number of frames transformed at once, bounds the memory
+    returns a float32 array of shape (nfft, n_frame // average)
+    """
+    x = _as_frames_source(x)
+    hop = nfft if hop is None else hop
+    step = hop * decimate
+    n_frame = max((x.shape[0] - nfft) // step + 1, 0)
+    n_frame -= n_frame % average
+    # batches hold whole columns
+    batch_frames = max(batch_frames // average, 1) * average
+
+    out = np.empty((n_frame // average, nfft), dtype=np.float32)
+    for idx, power in _power_batches(x, nfft, step, n_frame, window, fs, mode,
+                                     fftshift, workers, batch_frames):
+        if average > 1:
+            power = power.reshape(-1, average, nfft).mean(axis=1)
+        idx //= average
+        out[idx:idx + power.shape[0]] = power
+    if log:
+        _to_db(out, mode, floor)
+    return out.T
+
+
+def psd(x, nfft=512, window='hann', fs=1.0, log=True, fftshift=True,
+        workers=-1, batch_frames=1024):
+    """
+    averaged power spectral density (Welch method without overlap)
+
+    same arguments as `spectrogram`, returns a float32 array of size nfft
+    """
+    x = _as_frames_source(x)
+    n_frame = x.shape[0] // nfft
+    out = np.zeros(nfft, dtype=np.float64)
+    for _, power in _power_batches(x, nfft, nfft, n_frame, window, fs, 'psd',
+                                   fftshift, workers, batch_frames):
+        out += power.sum(axis=0, dtype=np.float64)
+    out = (out / max(n_frame, 1)).astype(np.float32)
+    if log:
+        _to_db(out, 'psd', None)
+    return out
+
+
+def frequencies(nfft, fs=1.0, fc=0.0, fftshift=True):
+    """frequency of each row of `spectrogram`, or each bin of `psd`"""
+    freq = fft.fftfreq(nfft, 1 / fs)
+    if fftshift:
+        freq = fft.fftshift(freq)
+    return freq + fc
+
+
+def _as_frames_source(x):
+    # int16 I/Q is kept as (n, 2) so that frames can be gathered without
+    # decoding the whole signal
+    x = np.asarray(x)
+    if x.dtype == np.int16:
+        return x.reshape(-1, 2)
+    if not np.iscomplexobj(x):
+        x = x.astype(np.complex64)
+    return x
+
+
+def _power_batches(x, nfft, step, n_frame, window, fs, mode, fftshift,
+                   workers, batch_frames):
+    """yield the power (or magnitude) spectrum of the frames, batch by batch"""
+    if window is None:
+        win = np.ones(nfft, dtype=np.float32)
+    elif isinstance(window, (str, tuple)):
+        win = signal.get_window(window, nfft).astype(np.float32)
+    else:
+        win = np.asarray(window, dtype=np.float32)
+    # same scaling as the twosided psd in matplotlib
+    scale = np.float32(1 / (fs * np.sum(win.astype(np.float64) ** 2)))
+    shift = nfft // 2 if fftshift else 0
+    offsets = np.arange(nfft)
+
+    complex_type = np.complex128 if x.dtype == np.complex128 \
+        else np.complex64
+    for idx in range(0, n_frame, batch_frames):
+        starts = np.arange(idx, min(idx + batch_frames, n_frame)) * step
+        if step == nfft:
+            # contiguous frames, a reshape is enough
+            frames = x[starts[0]:starts[-1] + nfft].reshape(
+                (len(starts), nfft) + x.shape[1:])
+        else:
+            frames = x[starts[:, None] + offsets]
+        if x.ndim == 2:
+            buf = np.empty((len(starts), nfft), dtype=np.complex64)
+            buf.real = frames[..., 0]
+            buf.imag = frames[..., 1]
+        else:
+            buf = frames.astype(complex_type)
+        buf *= win
+        spec = fft.fft(buf, axis=1, workers=workers, overwrite_x=True)
+
+        if mode == 'psd':
+            power = np.square(spec.real, dtype=np.float32)
+            power += np.square(spec.imag, dtype=np.float32)
+            power *= scale
+        elif mode == 'magnitude':
+            power = np.abs(spec).astype(np.float32, copy=False)
+        else:
+            raise ValueError('mode should be psd or magnitude')
+        if shift:
+            power = np.roll(power, shift, axis=1)
+        yield idx, power
+
+
+def _to_db(out, mode, floor):
+    """in place conversion to dB"""
+    if floor is None:
+        floor = np.finfo(np.float32).tiny
+    np.maximum(out, floor, out=out)
+    np.log10(out, out=out)
+    out *= 10 if mode == 'psd' else 20
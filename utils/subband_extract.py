@@ -0,0 +1,248 @@
+"""
+extract a frequency range of captures into smaller capture files
+
+the capture is streamed block by block: digital down-conversion of the
+target centre frequency to 0 Hz, low-pass filtering with a Kaiser FIR and
+decimation where only the kept outputs are computed (polyphase
+decimation). save_subband writes the result chunk by chunk as a v5
+capture with the updated fc_khz, fs_khz and bw_khz, the other header fields
+are kept; extract_subband returns it in memory.
+
+usage: python subband_extract.py [capture file or folder] --fc 2440 --bw 5
+-d [decimation factor, the largest one keeping the band by default]
+-f [target folder, same folder by default]
+"""
+
+import argparse
+import copy
+from pathlib import Path
+import numpy as np
+from scipy import signal
+import signal_file_handler as sfh
+
+
+class SubbandExtractor:
+    """
+    streaming down-conversion, filtering and decimation
+
+    blocks of samples are fed with `process`, the filter history and the
+    NCO phase are carried between blocks, so the output does not depend on
+    the block size. Output m is the filtered sample at input index
+    m * decimation (the filter delay is compensated), a signal of n samples
+    gives n // decimation outputs once `flush` is called.
+    """
+
+    def __init__(self, fs_khz, offset_khz, bw_khz, decimation,
+                 taps_per_phase=16, kaiser_beta=7.8562):
+        self.fs_khz = float(fs_khz)
+        self.offset_khz = float(offset_khz)
+        self.decimation = int(decimation)
+        n_tap = taps_per_phase * self.decimation + 1
+        # Stopband Attenuation = 80 dB, same as the Channelizer
+        self.taps = signal.firwin(
+            n_tap, bw_khz / 2, window=('kaiser', kaiser_beta),
+            fs=self.fs_khz).astype(np.float32)
+        self.delay = (n_tap - 1) // 2
+        self.reset()
+
+    def reset(self):
+        # zeros before the first sample, so that the first output sees
+        # the same (zero) history as lfilter
+        self._buffer = np.zeros(self.delay, dtype=np.complex64)
+        # local index in the buffer of the input sample of the next output
+        self._next = self.delay
+        self._n_in = 0
+        self._n_out = 0
+
+    def process(self, block):
+        """down-convert, filter and decimate the next block of samples"""
+        block = np.asarray(block)
+        if block.dtype == np.int16:
+            block = sfh.decode_iq(block.reshape(-1), np.complex64)
+        else:
+            block = block.astype(np.complex64, copy=False)
+        # NCO, the phase is computed in float64 from the sample index
+        cycles = np.arange(self._n_in, self._n_in + len(block),
+                           dtype=np.float64)
+        cycles *= -self.offset_khz / self.fs_khz
+        cycles %= 1.0
+        mixed = np.exp(2j * np.pi * cycles).astype(np.complex64)
+        mixed *= block
+        self._n_in += len(block)
+        return self._decimate(mixed)
+
+    def flush(self):
+        """outputs that still need samples after the end of the signal"""
+        n_out = self._n_in // self.decimation - self._n_out
+        out = self._decimate(np.zeros(self.delay, dtype=np.complex64))
+        return out[:max(n_out, 0)]
+
+    def _decimate(self, block):
+        buffer = np.concatenate((self._buffer, block))
+        # an output needs `delay` samples on each side of its input sample
+        n_out = max((len(buffer) - 1 - self.delay - self._next)
+                    // self.decimation + 1, 0)
+        out = np.zeros(n_out, dtype=np.complex64)
+        span = self.decimation * (n_out - 1) + 1
+        # y[m] = sum_k taps[k] * x[m * decimation + delay - k], only at
+        # the kept outputs
+        for tap_idx, tap in enumerate(self.taps if n_out else []):
+            start = self._next + self.delay - tap_idx
+            out += tap * buffer[start:start + span:self.decimation]
+        # keep the history of the next output
+        keep_from = self._next + n_out * self.decimation - self.delay
+        self._buffer = buffer[keep_from:]
+        self._next = self.delay
+        self._n_out += n_out
+        return out
+
+
+def choose_decimation(fs_khz, bw_khz, oversampling=1.25):
+    """
+    largest decimation factor that divides fs_khz and keeps
+    fs / decimation >= oversampling * bw
+    """
+    fs_khz = int(fs_khz)
+    max_decimation = max(int(fs_khz / (oversampling * bw_khz)), 1)
+    for decimation in range(max_decimation, 0, -1):
+        if fs_khz % decimation == 0:
+            return decimation
+    return 1
+
+
+def extract_subband(capture, fc_khz, bw_khz, decimation=None,
+                    block_samples=1 << 20, scale=1.0):
+    """
+    extract a frequency range of a capture in memory
+
+    capture: CaptureFile, preferably memory-mapped (mmap=True)
+    fc_khz: centre frequency of the range
+    bw_khz: bandwidth of the range, the filter passes +- bw_khz / 2
+    decimation: decimation factor, must divide fs_khz, see
+        choose_decimation by default
+    scale: gain applied before the conversion back to int16
+    returns a CaptureFile with the decimated int16 payload and the v5
+    header it is saved with, see save_subband to stream it to a file instead
+    """
+    new_header, _, blocks = _subband(capture, fc_khz, bw_khz, decimation,
+                                     block_samples, scale, version=5)
+    return sfh.CaptureFile(header=new_header, data=np.concatenate(
+        list(blocks) or [np.zeros(0, np.int16)]))
+
+
+def save_subband(capture, dest_path, fc_khz, bw_khz, decimation=None,
+                 block_samples=1 << 20, scale=1.0, version=5):
+    """
+    extract a frequency range of a capture into a capture file
+
+    same as extract_subband(...).save(dest_path, version=version), but the
+    header is written first and the payload block by block, so neither the
+    capture nor the result is ever fully in memory.
+    returns the header of the new capture
+    """
+    new_header, header_bytes, blocks = _subband(
+        capture, fc_khz, bw_khz, decimation, block_samples, scale, version)
+    payload_dtype = (sfh.CaptureHeader.PAYLOAD_BYTEORDER
+                     + sfh.CaptureHeader.PAYLOAD_FORMAT)
+    with open(str(dest_path), 'wb') as f:
+        f.write(header_bytes)
+        for block in blocks:
+            f.write(memoryview(block.astype(payload_dtype, copy=False)))
+    return new_header
+
+
+def _subband(capture, fc_khz, bw_khz, decimation, block_samples, scale,
+             version):
+    """
+    header of the extracted range and its packed bytes in the given
+    version, and a generator of its int16 I/Q blocks
+    """
+    header = capture.header
+    fs_khz = float(header.fs_khz)
+    offset_khz = fc_khz - float(header.fc_khz)
+    if abs(offset_khz) + bw_khz / 2 > fs_khz / 2:
+        raise ValueError('the range is outside of the capture band')
+    if decimation is None:
+        decimation = choose_decimation(fs_khz, bw_khz)
+    elif decimation < 1 or fs_khz % decimation:
+        # the header only stores an integer rate in kHz
+        raise ValueError('the decimation factor {} does not divide {:g} kHz'
+                         .format(decimation, fs_khz))
+
+    # pack the header of the decimated payload, then read it back so that
+    # total_len, header_len, header_version and dwell_time_ms match the file
+    n_out = capture.num_samples // decimation
+    new_header = copy.copy(header)
+    new_header.fc_khz = np.uint32(round(fc_khz))
+    new_header.fs_khz = np.uint32(fs_khz // decimation)
+    new_header.bw_khz = np.uint32(min(round(bw_khz), new_header.fs_khz))
+    header_bytes = sfh.CaptureFile(
+        header=new_header, data=np.zeros(0, np.int16)).header_bytes(
+            2 * n_out, version=version)
+    new_header = sfh.parse_capture_header(header_bytes)
+
+    def blocks():
+        extractor = SubbandExtractor(fs_khz, offset_khz, bw_khz, decimation)
+        for block in capture.iter_blocks(block_samples, dtype=np.int16):
+            yield _to_int16(extractor.process(block), scale)
+        yield _to_int16(extractor.flush(), scale)
+
+    return new_header, header_bytes, blocks()
+
+
+def _to_int16(samples, scale):
+    """interleaved int16 I/Q of complex samples"""
+    iq = np.stack((samples.real, samples.imag), axis=1).reshape(-1)
+    iq *= scale
+    np.clip(np.rint(iq), -32768, 32767, out=iq)
+    return iq.astype(np.int16)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='')
+    parser.add_argument('path', type=str,
+                        help='capture file or folder of the captures')
+    parser.add_argument('--fc', type=float, required=True,
+                        help='centre frequency of the range in MHz')
+    parser.add_argument('--bw', type=float, required=True,
+                        help='bandwidth of the range in MHz')
+    parser.add_argument('--decimation', '-d', type=int,
+                        help='decimation factor')
+    parser.add_argument('--target_folder', '-f', type=str,
+                        help='specify folder to save the captures')
+    parser.add_argument('--overwrite', '-o',
+                        action='store_true', default=False)
+    args = parser.parse_args()
+
+    path = Path(args.path)
+    paths = path.rglob('*.dat') if path.is_dir() else [path]
+    if args.target_folder is not None:
+        target_folder = Path(args.target_folder)
+        target_folder.mkdir(exist_ok=True)
+
+    suffix = '_{:g}MHz_{:g}MHz.dat'.format(args.fc, args.bw)
+    for path in paths:
+        if path.name.endswith(suffix):
+            # output of a previous run
+            continue
+        name = path.stem + suffix
+        if args.target_folder is None:
+            dest_path = path.with_name(name)
+        else:
+            dest_path = target_folder / name
+        if dest_path.exists() and not args.overwrite:
+            print('{}: target capture exists, skip.'.format(path))
+            continue
+
+        capture = sfh.CaptureFile(path=str(path), mmap=True)
+        try:
+            header = save_subband(capture, dest_path, args.fc * 1e3,
+                                  args.bw * 1e3, decimation=args.decimation)
+        except ValueError as err:
+            print('{}: {}'.format(path, err))
+            continue
+        print('{}: {} ({} kHz)'.format(path, dest_path, header.fs_khz))
+
+
+if __name__ == "__main__":
+    main()
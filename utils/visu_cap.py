@@ -1,8 +1,17 @@
 import numpy as np
-import matplotlib.pyplot as plt
+import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from pathlib import Path
 import argparse
+import time
+import zlib
+from PIL import Image
+from functools import partial
 import signal_file_handler as sfh
+import spectrogram as spg
+import power_envelope as pe
+import parallel
 
 """
 plot spectrograms, time and frequency domain plots from captures in a folder
@@ -10,76 +19,189 @@ plot spectrograms, time and frequency domain plots from captures in a folder
 usage: python visu_cap.py [folder path]
 -f [target folder to store images, same folder by default]
 -o overwrite the exist images
+-j [number of worker processes, 1 by default]
+-t label -s [seed of the random shifts, for reproducible label images]
 
 """
 
 
-def visu_for_analysis(capture, fig_path, nfft=512, fs=56, ant_idx=True, **kwargs):
-
-    data = capture.payload
-    _, ax = plt.subplots(3, 1, figsize=(8, 10))
-    ax[0].specgram(data, NFFT=nfft, Fc=capture.header.fc_khz/1e3, Fs=fs,
-                   noverlap=0, sides='twosided', cmap='viridis')
-    ax[0].set_xlabel('time (ms)')
-    ax[0].set_ylabel('frequency (MHz)')
-    ax[0].set_xticklabels(ax[0].get_xticks() / 1000)  # convert us to ms
-    ax[0].set_title('fc: {fc} MHz, fs: {fs} MHz, gain: {g} dB, SOM {som}'.format(
-        fc=capture.header.fc_khz/1e3, fs=capture.header.fs_khz/1e3,
-        g=capture.header.gain_db, som=capture.header.sensor_id))
-
-    ax[2].psd(data, NFFT=nfft, Fs=fs, Fc=capture.header.fc_khz/1e3, noverlap=0)
-    ax[2].set_xlabel('frequency (MHz)')
-
-    down_sample = 50
-    data = np.abs(data[0:-1:down_sample])
-    data[data < 1] = 1
-    time = np.arange(len(data)) / 56e6 * down_sample * 1000
-    ax[1].plot(time, 20 * np.log10(data), color='steelblue')
-    ax[1].set_ylim(bottom=20, top=80)
-    ax[1].set_xlim(left=0, right=time[-1])
-    ax[1].axhline(y=70, linestyle='--', color='r')
-
-    if ant_idx:
-        dwell_time = capture.header.ant_dwell_time_ms
-        for idx in range(capture.header.num_ant):
-            ax[1].axvline(x=(idx+1)*dwell_time, linestyle='--', color='k')
-            ant_seq = int(capture.header.ant_seq / (2 ** (4 * idx))) % 16
-            ax[1].text(x=idx*dwell_time+1, y=22, s=str(ant_seq))
-
-    ax[1].set_xlabel('time (ms)')
-    ax[1].set_ylabel('power (dB)')
-
-    plt.savefig(str(fig_path))
-    plt.close()
+class AnalysisRenderer:
+    """
+    plot the analysis images of many captures with one figure
+
+    the Agg figure and the axes are built once, each capture only updates
+    the image and line data. The plotted arrays are reduced before they
+    reach matplotlib: the spectrogram is averaged down to `max_columns`
+    columns and the power trace is the peak power of the envelope level
+    with at most `envelope_points` blocks, read from the capture sidecar.
+    """
+
+    def __init__(self, nfft=512, max_columns=1024, envelope_points=4096,
+                 workers=-1):
+        self.nfft = nfft
+        self.max_columns = max_columns
+        self.envelope_points = envelope_points
+        self.workers = workers
+
+        self.fig = Figure(figsize=(8, 10))
+        FigureCanvasAgg(self.fig)
+        self.ax = self.fig.subplots(3, 1)
+        self.image = self.ax[0].imshow(
+            np.zeros((2, 2), dtype=np.float32), aspect='auto',
+            origin='lower', cmap='viridis')
+        self.ax[0].set_xlabel('time (ms)')
+        self.ax[0].set_ylabel('frequency (MHz)')
+
+        self.power_line, = self.ax[1].plot([], [], color='steelblue')
+        self.ax[1].set_ylim(bottom=20, top=80)
+        self.ax[1].axhline(y=70, linestyle='--', color='r')
+        self.ax[1].set_xlabel('time (ms)')
+        self.ax[1].set_ylabel('power (dB)')
+        self.ant_artists = []
+
+        self.psd_line, = self.ax[2].plot([], [])
+        self.ax[2].set_xlabel('frequency (MHz)')
+        self.ax[2].set_ylabel('Power Spectral Density (dB/Hz)')
+        self.ax[2].grid(True)
+
+    def render(self, capture, fig_path, fs=None, ant_idx=True):
+        header = capture.header
+        fs = header.fs_khz / 1e3 if fs is None else fs
+        fc = header.fc_khz / 1e3
+        nfft = self.nfft
+        # the raw int16 view, frames are decoded batch by batch
+        data = capture.samples(dtype=np.int16)
+        duration = len(data) / fs / 1000  # ms
+
+        n_frame = len(data) // nfft
+        average = max(-(-n_frame // self.max_columns), 1)
+        spcg = spg.spectrogram(data, nfft=nfft, window='hann',
+                               average=average, fs=fs, workers=self.workers)
+        self.image.set_data(spcg)
+        self.image.set_clim(spcg.min(), spcg.max())
+        self.image.set_extent((0, duration, fc - fs / 2, fc + fs / 2))
+        self.ax[0].set_xlim(0, duration)
+        self.ax[0].set_ylim(fc - fs / 2, fc + fs / 2)
+        self.ax[0].set_title(
+            'fc: {fc} MHz, fs: {fs} MHz, gain: {g} dB, SOM {som}'.format(
+                fc=fc, fs=header.fs_khz/1e3, g=header.gain_db,
+                som=header.sensor_id))
+
+        envelope = pe.get_envelope(capture)
+        time, _, peak, _ = envelope.get(
+            envelope.level_for(self.envelope_points))
+        self.power_line.set_data(time, peak)
+        self.ax[1].set_xlim(left=0, right=duration)
+
+        for artist in self.ant_artists:
+            artist.remove()
+        self.ant_artists = []
+        if ant_idx:
+            dwell_time = header.ant_dwell_time_ms
+            for idx, ant in enumerate(header.antenna_sequence()):
+                self.ant_artists.append(self.ax[1].axvline(
+                    x=(idx+1)*dwell_time, linestyle='--', color='k'))
+                self.ant_artists.append(self.ax[1].text(
+                    x=idx*dwell_time+1, y=22, s=str(ant)))
+
+        self.psd_line.set_data(
+            spg.frequencies(nfft, fs=fs, fc=fc),
+            spg.psd(data, nfft=nfft, fs=fs, workers=self.workers))
+        self.ax[2].relim()
+        self.ax[2].autoscale_view()
+
+        self.fig.savefig(str(fig_path))
+
+
+_RENDERERS = {}
+
+
+def visu_for_analysis(capture, fig_path, nfft=512, fs=None, ant_idx=True,
+                      workers=-1, **kwargs):
+    if capture.num_samples < nfft:
+        # no spectrogram frame to plot
+        print('{}: fewer than {} samples, skip.'.format(fig_path, nfft))
+        return 0
+    # one renderer per process and parameters, reused across captures
+    key = (nfft, workers)
+    if key not in _RENDERERS:
+        _RENDERERS[key] = AnalysisRenderer(nfft=nfft, workers=workers)
+    _RENDERERS[key].render(capture, fig_path, fs=fs, ant_idx=ant_idx)
 
     return 0
 
 
-def visu_for_label(capture, fig_path, nfft=512, down_sample=20, **kwargs):
+def visu_for_label(capture, fig_path, nfft=512, down_sample=20, workers=-1,
+                   seed=None, **kwargs):
 
-    data = capture.payload
     seg_len = nfft * nfft * down_sample
-    nseg = len(data) // seg_len
+    nseg = capture.num_samples // seg_len
+    if nseg == 0:
+        return 0
+    data = capture.samples(0, nseg * seg_len / capture.header.fs_khz,
+                           dtype=np.int16)
+    # one frame every nfft * down_sample samples (down sampling), all the
+    # segments go through a single batched FFT
+    spcg = spg.spectrogram(data, nfft=nfft, hop=nfft * down_sample,
+                           mode='magnitude', log=False, fftshift=False,
+                           workers=workers, batch_frames=nseg * nfft)
+    # (freq, seg, time) -> (seg, freq, time)
+    spcg = spcg.reshape(nfft, nseg, nfft).transpose(1, 0, 2)
+
+    # flip the frequency axis, then roll each segment by a random shift.
+    # the rng is seeded per file so that the result does not depend on the
+    # processing order
+    if seed is not None:
+        seed = [seed, zlib.crc32(fig_path.stem.encode())]
+    shift = np.random.default_rng(seed).integers(nfft, size=nseg)
+    rows = nfft - 1 - (np.arange(nfft) - shift[:, None]) % nfft
+    data_fft = spcg[np.arange(nseg)[:, None], rows]
+
+    data_fft[data_fft < 1] = 1
+    np.log10(data_fft, out=data_fft)
+
+    lut = _bone_r_lut()
     for idx_seg in range(nseg):
-        data_rsp = np.reshape(data[idx_seg * seg_len:
-                              (idx_seg + 1) * seg_len], (nfft, -1))
-        # down sampling
-        data_rsp = data_rsp[:, :nfft]
-        data_fft = np.fft.fft(data_rsp, axis=1)
-        # data_fft = np.fft.fftshift(data_fft, axes=1)
-        data_fft = np.flip(data_fft, axis=1)
-        shift = np.random.randint(nfft)
-        data_fft = np.roll(data_fft, shift, axis=1)
-
-        data_fft = np.abs(data_fft.T)
-        data_fft[data_fft < 1] = 1
-        data_fft = np.log10(data_fft)
         name = fig_path.stem + '_' + str(idx_seg) + '.jpg'
-        plt.imsave(str(fig_path.with_name(name)), data_fft, cmap='bone_r')
+        Image.fromarray(lut[_to_uint8(data_fft[idx_seg])]).save(
+            str(fig_path.with_name(name)))
 
     return 0
 
 
+def _bone_r_lut():
+    # same colors as plt.imsave(..., cmap='bone_r')
+    global _BONE_R_LUT
+    if _BONE_R_LUT is None:
+        cmap = matplotlib.colormaps['bone_r']
+        _BONE_R_LUT = cmap(np.arange(cmap.N), bytes=True)[:, :3]
+    return _BONE_R_LUT
+
+
+_BONE_R_LUT = None
+
+
+def _to_uint8(image):
+    # scale the image between its min and max like plt.imsave
+    vmin, vmax = image.min(), image.max()
+    if vmax == vmin:
+        return np.zeros(image.shape, dtype=np.uint8)
+    image = (image - vmin) * (256 / (vmax - vmin))
+    return np.minimum(image, 255).astype(np.uint8)
+
+
+VISU = {'analysis': visu_for_analysis, 'label': visu_for_label}
+
+
+def render(path, fig_path, visu_type, ant_idx, workers=-1, seed=None):
+    """load and plot one capture, returns the time used and the file size"""
+    tic = time.perf_counter()
+    capture = sfh.CaptureFile(path=str(path), mmap=True)
+    VISU[visu_type](capture, fig_path, ant_idx=ant_idx, workers=workers,
+                    seed=seed)
+    return time.perf_counter() - tic, path.stat().st_size
+
+
 def main():
     parser = argparse.ArgumentParser(description='')
     parser.add_argument('folder', type=str,
@@ -87,36 +209,61 @@ def main():
     parser.add_argument('--overwrite', '-o',
                         action='store_true', default=False)
     parser.add_argument('--ant_idx', '-a',
-                        action='store_true', default=False)                    
+                        action='store_true', default=False)
     parser.add_argument('--target_folder', '-f', type=str,
                         help='specify folder to save spectrograms')
     parser.add_argument('--type', '-t', type=str, choices=[
                         'analysis', 'label'], default='analysis',
                         help='type of visualization to generate')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='number of captures processed in parallel')
+    parser.add_argument('--seed', '-s', type=int,
+                        help='seed of the random shifts of the label images')
     args = parser.parse_args()
     crt_fd = Path(args.folder)
     path_gen = crt_fd.rglob('*.dat')
-    if args.type == 'analysis':
-        visu = visu_for_analysis
-    elif args.type == 'label':
-        visu = visu_for_label
 
     if args.target_folder is not None:
         target_folder = Path(args.target_folder)
         target_folder.mkdir(exist_ok=True)
 
-    for path in path_gen:
-        print(str(path))
-        capture = sfh.CaptureFile(path=str(path))
-        if args.target_folder is None:
-            fig_path = path.with_suffix('.jpg')
-        else:
-            fig_path = target_folder / Path(path.name).with_suffix('.jpg')
+    def todo():
+        for path in path_gen:
+            if args.target_folder is None:
+                fig_path = path.with_suffix('.jpg')
+            else:
+                fig_path = target_folder / Path(path.name).with_suffix('.jpg')
 
-        if fig_path.exists() and not args.overwrite:
-            print('target image exists, skip.')
+            if fig_path.exists() and not args.overwrite:
+                print('{}: target image exists, skip.'.format(path))
+                continue
+            yield path, fig_path
+
+    n_file = 0
+    n_bytes = 0
+    tic = time.perf_counter()
+
+    def report(path, result):
+        nonlocal n_file, n_bytes
+        elapsed, size = result
+        n_file += 1
+        n_bytes += size
+        print('{}: {:.2f} s'.format(path, elapsed))
+
+    # in parallel, each worker uses a single FFT thread
+    render_one = partial(render, visu_type=args.type, ant_idx=args.ant_idx,
+                         workers=-1 if args.jobs <= 1 else 1,
+                         seed=args.seed)
+    for (path, _), result, err in parallel.process_map(
+            render_one, todo(), jobs=args.jobs):
+        if err is not None:
+            print('{}: failed, {!r}'.format(path, err))
             continue
-        visu(capture, fig_path, ant_idx=args.ant_idx)
+        report(path, result)
+
+    elapsed = time.perf_counter() - tic
+    print('{} captures in {:.1f} s, {:.2f} files/s, {:.1f} MB/s'.format(
+        n_file, elapsed, n_file / elapsed, n_bytes / 1e6 / elapsed))
 
 
 if __name__ == "__main__":